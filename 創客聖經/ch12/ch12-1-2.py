@@ -1,6 +1,6 @@
-from tflite_runtime.interpreter import Interpreter 
 import cv2
 import numpy as np
+from tflite_utils import load_interpreter, timings_text, InputTensor
 import time
 
 # data_folder = "/home/pi/ch12/mobilenet/"
@@ -8,21 +8,18 @@ data_folder = "mobilenet/"
 model_path = data_folder + "mobilenet_v1_1.0_224_quantized_1_metadata_1.tflite"
 label_path = data_folder + "labels.txt"
 
-interpreter = Interpreter(model_path)
-print("成功載入模型...")
-interpreter.allocate_tensors()
-_, height, width, _ = interpreter.get_input_details()[0]["shape"]
+interpreter, timings = load_interpreter(model_path)
+print("成功載入模型...", timings_text(timings))
+input_tensor = InputTensor(interpreter)
+height, width = input_tensor.height, input_tensor.width
 print("圖片資訊: (", width, ",", height, ")")
 
 time1 = time.time()
 
 image = cv2.imread("images/test.jpg")
-image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-image_resized = cv2.resize(image_rgb, (width, height))
-input_data = np.expand_dims(image_resized, axis=0)
-interpreter.set_tensor(interpreter.get_input_details()[0]["index"],input_data)
+input_tensor.set_image(image)
 interpreter.invoke()
-output_details = interpreter.get_output_details()[0]
+output_details = input_tensor.output_details[0]
 output = np.squeeze(interpreter.get_tensor(output_details["index"]))
 scale, zero_point = output_details["quantization"]
 output = scale * (output - zero_point)
@@ -1,6 +1,6 @@
-from tflite_runtime.interpreter import Interpreter 
 import cv2
 import numpy as np
+from tflite_utils import load_interpreter, timings_text, InputTensor, get_detection_outputs, postprocess_detections, draw_detections
 import time
 
 # data_folder = "/home/pi/ch12/ssd_mobilenet/"
@@ -11,12 +11,11 @@ min_conf_threshold = 0.5
 
 with open(label_path, "r") as f:
     labels = [line.strip() for line in f.readlines()]
-interpreter = Interpreter(model_path=model_path)
-print("成功載入模型...")
-interpreter.allocate_tensors()
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
-_, height, width, _ = interpreter.get_input_details()[0]["shape"]
+interpreter, timings = load_interpreter(model_path)
+print("成功載入模型...", timings_text(timings))
+input_tensor = InputTensor(interpreter)
+output_details = input_tensor.output_details
+height, width = input_tensor.height, input_tensor.width
 print("圖片資訊: (", width, ",", height, ")")
 
 time1 = time.time()
@@ -24,37 +23,17 @@ image = cv2.imread("images/horse.jpg")
 #image = cv2.imread("images/koala.jpg")
 #image = cv2.imread("images/test.jpg")
 imgHeight, imgWidth, _ = image.shape
-image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-image_resized = cv2.resize(image_rgb, (width, height))
-input_data = np.expand_dims(image_resized, axis=0)
-interpreter.set_tensor(input_details[0]["index"],input_data)
+input_tensor.set_image(image)
 interpreter.invoke()
-boxes = interpreter.get_tensor(output_details[0]["index"])[0]
-classes = interpreter.get_tensor(output_details[1]["index"])[0]
-scores = interpreter.get_tensor(output_details[2]["index"])[0] 
+boxes, classes, scores = get_detection_outputs(interpreter, output_details)
+detections = postprocess_detections(boxes, classes, scores, imgHeight, imgWidth, min_conf_threshold)
 
 time2 = time.time()
 classification_time = np.round(time2-time1, 3)
 print("辨識時間 =", classification_time, "秒")
 
-for i in range(len(scores)):
-    if ((scores[i] > 0.5) and (scores[i] <= 1.0)):
-         min_y = int(max(1,(boxes[i][0] * imgHeight)))
-         min_x = int(max(1,(boxes[i][1] * imgWidth)))
-         max_y = int(min(imgHeight,(boxes[i][2] * imgHeight)))
-         max_x = int(min(imgWidth,(boxes[i][3] * imgWidth)))              
-         cv2.rectangle(image, (min_x,min_y), (max_x,max_y), (10,255,0), 2)  
-         object_name = labels[int(classes[i])]
-         label = "%s: %d%%" % (object_name, int(scores[i]*100))
-         labelSize, baseLine = cv2.getTextSize(label,
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-         label_min_y = max(min_x, labelSize[1] + 10)
-         cv2.rectangle(image, (min_x, label_min_y-labelSize[1]-10),
-                              (min_x+labelSize[0], label_min_y+baseLine-10), 
-                              (255, 255, 255), cv2.FILLED) 
-         cv2.putText(image, label, (min_x, label_min_y-7), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-         
+draw_detections(image, detections, labels)
+
 cv2.imshow("Object Detector", image)
 cv2.waitKey(0)
 cv2.destroyAllWindows()         
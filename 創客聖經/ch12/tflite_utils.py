@@ -0,0 +1,184 @@
+import os
+import time
+import cv2
+import numpy as np
+from tflite_runtime.interpreter import Interpreter
+
+# Helpers shared by the TensorFlow Lite scripts. ch12/tflite_utils.py and
+# ch16/ch16-4/tflite_utils.py are the same file, keep them in sync
+
+_NUM_THREADS = None  # interpreter threads, None uses every CPU core
+_WARMUP_RUNS = 3     # invokes on a dummy input before the first real frame
+
+
+def load_interpreter(model_path, num_threads=None, warmup_runs=None):
+    """
+    Load a model with num_threads interpreter threads and run warmup_runs
+    invokes on a zero input, so the first camera frames already run at
+    steady-state speed. Returns (interpreter, timings), timings holds the
+    thread count, the load time and each warm-up invoke time in seconds
+    """
+    if num_threads is None:
+        num_threads = _NUM_THREADS or os.cpu_count() or 1
+    if warmup_runs is None:
+        warmup_runs = _WARMUP_RUNS
+
+    start = time.monotonic()
+    interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    timings = {'num_threads': num_threads, 'load': time.monotonic() - start, 'warmup': []}
+
+    detail = interpreter.get_input_details()[0]
+    interpreter.set_tensor(detail["index"], np.zeros(detail["shape"], detail["dtype"]))
+    for _ in range(warmup_runs):
+        start = time.monotonic()
+        interpreter.invoke()
+        timings['warmup'].append(time.monotonic() - start)
+    return interpreter, timings
+
+
+def timings_text(timings):
+    return "%d threads, load %.0f ms, warm-up %s ms" % (
+        timings['num_threads'], timings['load'] * 1000,
+        '/'.join('%.0f' % (t * 1000) for t in timings['warmup']) or '-')
+
+
+class Detection(object):
+    """ One detected object: class id, score and its own box in image pixels ((min_x, min_y), (max_x, max_y)) """
+    __slots__ = ('label_id', 'score', 'bounding_box')
+
+    def __init__(self, label_id, score, bounding_box):
+        self.label_id = label_id
+        self.score = score
+        self.bounding_box = bounding_box
+
+
+class InputTensor(object):
+    """
+    Writes preprocessed images straight into the interpreter's input tensor,
+    through the numpy view from interpreter.tensor(), so no per-frame arrays
+    are allocated for cvtColor, resize, expand_dims or set_tensor. Also caches
+    the input and output details, which are not worth asking for every frame
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.input_details = interpreter.get_input_details()
+        self.output_details = interpreter.get_output_details()
+        _, self.height, self.width, self.channels = self.input_details[0]["shape"]
+        self.dtype = self.input_details[0]["dtype"]
+        # an int8/uint8 input with a scale is quantized, see quantize_lut()
+        self.quantization = self.input_details[0]["quantization"]
+        self.quantized = self.dtype in (np.int8, np.uint8) and self.quantization[0] != 0
+        # calling self.tensor() gives a view of the input buffer. Never keep that view
+        # around: interpreter.invoke() refuses to run while a view is alive
+        self.tensor = interpreter.tensor(self.input_details[0]["index"])
+        self.buffers = {}
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        # scratch array reused between frames, reallocated only when the shape changes
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def set_image(self, image, code=cv2.COLOR_BGR2RGB, divide_by=None):
+        """
+        Resize image to the model input size and write it into the input tensor.
+        The color conversion runs after the resize, on the smaller image
+        """
+        resized = self.buffer('resized', (self.height, self.width, image.shape[2]))
+        cv2.resize(image, (int(self.width), int(self.height)), dst=resized)
+        self.write(resized, code, divide_by)
+
+    def write(self, image, code=None, divide_by=None, index=0):
+        """
+        image must already have the model input size. divide_by: the model
+        was trained on pixel / divide_by (e.g. 255). For a float input that
+        is one float32 divide, for a quantized input it is folded into a
+        lookup table, so a fully int8 model needs no float math at all.
+        An int8 input is always quantized, without divide_by the model takes
+        the pixel values as they are. index: the slot of a batched input
+        (see resize_tensor_input)
+        """
+        if divide_by is None and self.dtype == np.int8:
+            # pixels above 127 would wrap around in a plain copy
+            if not self.quantized:
+                raise ValueError('int8 input tensor without quantization parameters, cannot write uint8 pixels to it')
+            divide_by = 1
+        if code is not None:
+            if divide_by is None and self.dtype == np.uint8:
+                cv2.cvtColor(image, code, dst=self.tensor()[index])
+                return
+            image = cv2.cvtColor(image, code, dst=self.buffer('converted', image.shape[:2] + (self.channels,)))
+        if divide_by is None:
+            np.copyto(self.tensor()[index], image, casting='unsafe')
+        elif self.quantized:
+            cv2.LUT(image, self.quantize_lut(divide_by), dst=self.tensor()[index])
+        else:
+            np.divide(image, self.dtype(divide_by), out=self.tensor()[index], casting='unsafe')
+
+    def quantize_lut(self, divide_by):
+        # pixel -> round(pixel / divide_by / scale + zero_point), for each of the 256 pixel values
+        lut = self.buffers.get(('lut', divide_by))
+        if lut is None:
+            scale, zero_point = self.quantization
+            info = np.iinfo(self.dtype)
+            lut = np.round(np.arange(256) / float(divide_by) / scale + zero_point)
+            lut = self.buffers[('lut', divide_by)] = np.clip(lut, info.min, info.max).astype(self.dtype)
+        return lut
+
+
+def get_output(interpreter, output_detail):
+    """ The output tensor as float32, dequantized if the model has a quantized output """
+    output = interpreter.get_tensor(output_detail["index"])
+    scale, zero_point = output_detail["quantization"]
+    if output.dtype in (np.int8, np.uint8) and scale != 0:
+        return scale * (output.astype(np.float32) - zero_point)
+    return output
+
+
+def get_detection_outputs(interpreter, output_details):
+    # boxes, classes and scores of an SSD detection model, batch 0
+    boxes = interpreter.get_tensor(output_details[0]["index"])[0]
+    classes = interpreter.get_tensor(output_details[1]["index"])[0]
+    scores = interpreter.get_tensor(output_details[2]["index"])[0]
+    return boxes, classes, scores
+
+
+def postprocess_detections(boxes, classes, scores, image_height, image_width, min_confidence=0.5):
+    """
+    Keep the detections scoring above min_confidence and scale their
+    normalized (y1, x1, y2, x2) boxes to image pixels, all with array
+    operations instead of a Python loop over every score
+    """
+    keep = (scores > min_confidence) & (scores <= 1.0)
+    if not keep.any():
+        return []
+
+    scaled = boxes[keep] * np.array([image_height, image_width, image_height, image_width], np.float32)
+    corners = np.empty((len(scaled), 4), np.int32)
+    corners[:, 0] = np.maximum(1, scaled[:, 1])             # min_x
+    corners[:, 1] = np.maximum(1, scaled[:, 0])             # min_y
+    corners[:, 2] = np.minimum(image_width, scaled[:, 3])   # max_x
+    corners[:, 3] = np.minimum(image_height, scaled[:, 2])  # max_y
+
+    return [Detection(int(label_id), float(score), ((min_x, min_y), (max_x, max_y)))
+            for label_id, score, (min_x, min_y, max_x, max_y)
+            in zip(classes[keep], scores[keep], corners.tolist())]
+
+
+def draw_detections(frame, detections, labels):
+    # draw each box with a "label: score%" tag, labels maps class id to name (a list or a dict)
+    for detection in detections:
+        (min_x, min_y), (max_x, max_y) = detection.bounding_box
+        cv2.rectangle(frame, (min_x, min_y), (max_x, max_y), (10, 255, 0), 2)
+        label = "%s: %d%%" % (labels[detection.label_id], int(detection.score * 100))
+        labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+        label_min_y = max(min_y, labelSize[1] + 10)
+        cv2.rectangle(frame, (min_x, label_min_y - labelSize[1] - 10),
+                      (min_x + labelSize[0], label_min_y + baseLine - 10),
+                      (255, 255, 255), cv2.FILLED)
+        cv2.putText(frame, label, (min_x, label_min_y - 7),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    return frame
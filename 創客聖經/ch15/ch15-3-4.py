@@ -1,23 +1,33 @@
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, request
 import cv2
+from base_camera import BaseCamera, StreamOptions
 
 app = Flask(__name__)
 cap = cv2.VideoCapture(8)  # 樹莓派5同時連接Pi相機模組是8; 樹莓派4是1, 否則是0
 
-def get_frames():
+class Camera(BaseCamera):
+    """cap is only read by the camera thread of BaseCamera, each frame is
+    encoded once and the same JPEG goes to every client"""
+    @staticmethod
+    def frames():
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            else:
+                _, buffer = cv2.imencode(".jpg", frame)
+                yield buffer.tobytes()
+
+def get_frames(camera, options):
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        else:
-            _, buffer = cv2.imencode(".jpg", frame)
-            frame = buffer.tobytes()
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+        frame = camera.get_frame(options)
+        yield (b"--frame\r\n"
+               b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
 
 @app.route("/video_feed")
 def video_feed():
-    return Response(get_frames(),
+    """Takes the StreamOptions query parameters, e.g. /video_feed?scale=2&quality=60&fps=10"""
+    return Response(get_frames(Camera(), StreamOptions(request.args)),
                     mimetype="multipart/x-mixed-replace; boundary=frame")
 
 @app.route("/")
@@ -1,23 +1,33 @@
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, request
 from picamera2 import Picamera2
 import cv2
+from base_camera import BaseCamera, StreamOptions
 
 app = Flask(__name__)
 picam2 = Picamera2()
 picam2.start()
 
-def get_frames():
+class Camera(BaseCamera):
+    """picam2 is only read by the camera thread of BaseCamera, each frame is
+    encoded once and the same JPEG goes to every client"""
+    @staticmethod
+    def frames():
+        while True:
+            frame = picam2.capture_array()
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) 
+            _, buffer = cv2.imencode(".jpg", frame)
+            yield buffer.tobytes()
+
+def get_frames(camera, options):
     while True:
-        frame = picam2.capture_array()
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) 
-        _, buffer = cv2.imencode(".jpg", frame)
-        frame = buffer.tobytes()
+        frame = camera.get_frame(options)
         yield (b"--frame\r\n"
                b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
 
 @app.route("/video_feed")
 def video_feed():
-    return Response(get_frames(),
+    """Takes the StreamOptions query parameters, e.g. /video_feed?scale=2&quality=60&fps=10"""
+    return Response(get_frames(Camera(), StreamOptions(request.args)),
                     mimetype="multipart/x-mixed-replace; boundary=frame")
 
 @app.route("/")
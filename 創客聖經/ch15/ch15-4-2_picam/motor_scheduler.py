@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+class MotorScheduler(object):
+    """Runs timed motor commands in one worker thread. submit() only hands the
+    command over and returns at once, so a button press never holds a request
+    thread. A new command preempts the running one: it starts right away and
+    the rest of the old command's time is dropped, so rapid taps never queue
+    up behind each other.
+    """
+    def __init__(self, stop):
+        self.stop = stop  # called when a timed command runs out
+        self.condition = threading.Condition()
+        self.pending = None  # (name, action, duration, submit time)
+        self.last_command = None
+        self.preempted = 0
+        self.count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, action, duration=None):
+        """Run action() now, and stop() after duration seconds unless another
+        command comes first. duration None: no automatic stop."""
+        with self.condition:
+            if self.pending is not None:
+                self.preempted += 1  # never started, replaced by this one
+            self.pending = (name, action, duration, time.monotonic())
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or self.closed)
+                if self.closed:
+                    break
+                name, action, duration, submitted = self.pending
+                self.pending = None
+                self.last_command = name
+                latency = time.monotonic() - submitted
+                self.count += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self.last_latency = latency
+            action()
+            if duration is None:
+                continue
+            with self.condition:
+                # wake up early on a new command, it takes over the motors
+                if self.condition.wait_for(lambda: self.pending is not None or self.closed, duration):
+                    self.preempted += 1
+                    continue
+            self.stop()
+
+    def summary(self):
+        """Queue latency (submit to motor command) of the commands so far."""
+        with self.condition:
+            mean = self.total_latency / self.count if self.count else 0.0
+            return ('%s, queue latency: last %.1f ms, mean %.1f ms, max %.1f ms (n=%d), %d commands preempted' %
+                    (self.last_command, self.last_latency * 1000, mean * 1000, self.max_latency * 1000,
+                     self.count, self.preempted))
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.stop()
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 from importlib import import_module
 import os
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, request
 from gpiozero import Motor
-from time import sleep
+from base_camera import StreamOptions
+from motor_scheduler import MotorScheduler
 
 # import camera driver
 #if os.environ.get('CAMERA'):
@@ -47,55 +48,55 @@ def turn_left(speed=0.5):
     
 speed = 0.5
 
+# the routes only hand commands to the scheduler's thread and return at once
+motors = MotorScheduler(stop)
+
 @app.route("/f")
 def go_forward():
-    forward(speed)
-    sleep(delay)
-    stop()
+    motors.submit('forward', lambda: forward(speed), delay)
     return "Forward..."
 
 @app.route("/b")
 def go_backward():
-    backward(speed)
-    sleep(delay)
-    stop()
+    motors.submit('backward', lambda: backward(speed), delay)
     return "Backward..."
 
 @app.route("/r")
 def go_turn_right():
-    turn_right(speed)
-    sleep(delay)
-    stop()
+    motors.submit('turn right', lambda: turn_right(speed), delay)
     return "Turn Right..."
     
 @app.route("/l")
 def go_turn_left():
-    turn_left(speed)
-    sleep(delay)
-    stop()
+    motors.submit('turn left', lambda: turn_left(speed), delay)
     return "Turn Left..."
 
 @app.route("/s")
 def go_stope():
-    stop()
+    motors.submit('stop', stop)
     return "Stop..."
+
+@app.route("/latency")
+def motor_latency():
+    return motors.summary()
     
 @app.route('/')
 def index():
     """Video streaming home page."""
     return render_template('index.html')
 
-def gen(camera):
+def gen(camera, options):
     """Video streaming generator function."""
     while True:
-        frame = camera.get_frame()
+        frame = camera.get_frame(options)
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
 @app.route('/video_feed')
 def video_feed():
-    """Video streaming route. Put this in the src attribute of an img tag."""
-    return Response(gen(Camera()),
+    """Video streaming route. Put this in the src attribute of an img tag.
+    Takes the StreamOptions query parameters, e.g. /video_feed?scale=2&fps=10"""
+    return Response(gen(Camera(), StreamOptions(request.args)),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 if __name__ == '__main__':
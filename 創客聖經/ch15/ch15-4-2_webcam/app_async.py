@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+from gpiozero import Motor
+from async_streaming import StreamingServer
+from motor_scheduler import MotorScheduler
+
+# import camera driver
+#if os.environ.get('CAMERA'):
+#    Camera = import_module('camera_' + os.environ['CAMERA']).Camera
+#else:
+#    from camera import Camera
+
+# Raspberry Pi camera module (requires picamera package)
+#from camera_pi import Camera
+# OpenCV Webcam
+from camera_opencv import Camera
+# OpenCV Pi camera module
+#from camera_opencv_picam import Camera
+
+# one task per viewer instead of one thread, see async_streaming.py
+app = StreamingServer(Camera)
+
+motor1 = Motor(forward=18, backward=23, pwm=True)
+motor2 = Motor(forward=24, backward=25, pwm=True)
+
+delay = 1
+
+def stop():
+    motor1.stop()
+    motor2.stop()
+    
+def forward(speed=1.0):
+    motor1.forward(speed)
+    motor2.forward(speed)
+
+def backward(speed=1.0):
+    motor1.backward(speed)
+    motor2.backward(speed)   
+    
+def turn_right(speed=0.5):
+    motor1.forward(speed)   
+    motor2.stop()   
+    
+def turn_left(speed=0.5): 
+    motor1.stop()
+    motor2.forward(speed)  
+    
+speed = 0.5
+
+# the routes only hand commands to the scheduler's thread and return at once
+motors = MotorScheduler(stop)
+
+@app.route("/f")
+async def go_forward(request):
+    motors.submit('forward', lambda: forward(speed), delay)
+    return "Forward..."
+
+@app.route("/b")
+async def go_backward(request):
+    motors.submit('backward', lambda: backward(speed), delay)
+    return "Backward..."
+
+@app.route("/r")
+async def go_turn_right(request):
+    motors.submit('turn right', lambda: turn_right(speed), delay)
+    return "Turn Right..."
+    
+@app.route("/l")
+async def go_turn_left(request):
+    motors.submit('turn left', lambda: turn_left(speed), delay)
+    return "Turn Left..."
+
+@app.route("/s")
+async def go_stope(request):
+    motors.submit('stop', stop)
+    return "Stop..."
+
+@app.route("/latency")
+async def motor_latency(request):
+    return motors.summary()
+    
+@app.route('/')
+async def index(request):
+    """Video streaming home page."""
+    return app.render_template('index.html')
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0')
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from urllib.parse import parse_qsl
+from jinja2 import Environment, FileSystemLoader
+from base_camera import StreamOptions
+
+
+class AsyncFrameBroadcaster(object):
+    """The asyncio side of BaseCamera.broadcaster: the newest frame and its
+    sequence number, every client task waits for a frame newer than the last
+    one it sent. Only used from the event loop thread.
+    """
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.frame = None
+        self.seq = 0
+
+    async def publish(self, seq, frame):
+        async with self.condition:
+            self.frame = frame
+            self.seq = seq
+            self.condition.notify_all()
+
+    async def wait(self, last_seq=0):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.seq > last_seq)
+            return self.seq, self.frame
+
+
+class Request(object):
+    def __init__(self, method, path, headers, args):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.args = args  # query string parameters
+
+
+class StreamingServer(object):
+    """A small asyncio HTTP server with the routes of the Flask video apps.
+    Each viewer of /video_feed is a task, not a thread: one relay thread reads
+    the camera and hands every frame to the event loop, which sends the same
+    JPEG bytes to all viewers. Handlers are coroutines taking the request and
+    returning the response text, registered with @app.route(path) like Flask.
+    """
+    def __init__(self, camera_class, template_folder='templates', send_timeout=10):
+        self.camera_class = camera_class
+        self.templates = Environment(loader=FileSystemLoader(template_folder))
+        self.templates.globals['url_for'] = lambda endpoint: '/' + endpoint
+        self.send_timeout = send_timeout  # seconds a viewer may take to accept a frame
+        self.routes = {'/video_feed': self.video_feed}
+        self.broadcaster = None
+        self.loop = None
+        self.viewers = 0
+        self.relay = None  # only changed from the event loop thread
+
+    def route(self, path):
+        def decorator(handler):
+            self.routes[path] = handler
+            return handler
+        return decorator
+
+    def render_template(self, name, **context):
+        return self.templates.get_template(name).render(**context)
+
+    def start_relay(self):
+        """Start the relay thread if there are viewers and none is running."""
+        if self.relay is None and self.viewers > 0:
+            self.relay = threading.Thread(target=self._relay, daemon=True)
+            self.relay.start()
+
+    def _relay_stopped(self):
+        # a viewer may have come in while the thread was on its way out
+        self.relay = None
+        self.start_relay()
+
+    def _relay(self):
+        """Camera relay thread: runs while there are viewers."""
+        try:
+            camera = self.camera_class()
+            seq = 0
+            while self.viewers > 0:
+                frame = camera.get_frame()
+                if camera.last_seq > seq:
+                    seq = camera.last_seq
+                    asyncio.run_coroutine_threadsafe(self.broadcaster.publish(seq, frame), self.loop)
+        finally:
+            self.loop.call_soon_threadsafe(self._relay_stopped)
+
+    async def video_feed(self, request, writer):
+        """Video streaming route. Put this in the src attribute of an img tag.
+        Takes the StreamOptions query parameters, e.g. /video_feed?scale=2&fps=10"""
+        options = StreamOptions(request.args)
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        self.viewers += 1
+        self.start_relay()
+        try:
+            seq = 0
+            while True:
+                # a slow viewer skips to the newest frame once it is ready again
+                seq, frame = await self.broadcaster.wait(seq)
+                scale, quality = options.rendition()
+                if scale != 1 or quality is not None:
+                    # encoded in a worker thread, once per frame for all viewers of this rendition
+                    frame = await self.loop.run_in_executor(
+                        None, self.camera_class.renditions.get, seq, frame, scale, quality)
+                start = time.monotonic()
+                writer.writelines([b'--frame\r\nContent-Type: image/jpeg\r\n\r\n', frame, b'\r\n'])
+                await asyncio.wait_for(writer.drain(), self.send_timeout)
+                sent = time.monotonic() - start
+                options.sent(sent)
+                if options.max_fps:
+                    await asyncio.sleep(max(1.0 / options.max_fps - sent, 0))
+        finally:
+            self.viewers -= 1
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().title()] = value.strip()
+            path, _, query = path.partition('?')
+            request = Request(method, path, headers, dict(parse_qsl(query)))
+
+            handler = self.routes.get(request.path)
+            if handler == self.video_feed:
+                await self.video_feed(request, writer)
+                return
+            if handler is None:
+                status, body = '404 Not Found', 'Not Found'
+            else:
+                status, body = '200 OK', await handler(request)
+            body = body.encode('utf-8')
+            writer.write(('HTTP/1.1 %s\r\nContent-Type: text/html; charset=utf-8\r\n'
+                          'Content-Length: %d\r\nConnection: close\r\n\r\n' % (status, len(body))).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except (ValueError, ConnectionError, asyncio.TimeoutError):
+            pass  # bad request line, or the client went away
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self.broadcaster = AsyncFrameBroadcaster()
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print('Serving on http://%s:%d' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='0.0.0.0', port=5000):
+        asyncio.run(self.serve(host, port))
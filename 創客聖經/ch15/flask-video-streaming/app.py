@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 from importlib import import_module
 import os
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, request
+from base_camera import StreamOptions
 
 # import camera driver
 if os.environ.get('CAMERA'):
@@ -11,6 +12,8 @@ else:
 
 # Raspberry Pi camera module (requires picamera package)
 # from camera_pi import Camera
+# Raspberry Pi camera module, JPEGs encoded by the camera pipeline (requires picamera2)
+# from camera_picamera2_mjpeg import Camera
 
 app = Flask(__name__)
 
@@ -21,18 +24,19 @@ def index():
     return render_template('index.html')
 
 
-def gen(camera):
+def gen(camera, options):
     """Video streaming generator function."""
     while True:
-        frame = camera.get_frame()
+        frame = camera.get_frame(options)
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
 
 @app.route('/video_feed')
 def video_feed():
-    """Video streaming route. Put this in the src attribute of an img tag."""
-    return Response(gen(Camera()),
+    """Video streaming route. Put this in the src attribute of an img tag.
+    Takes the StreamOptions query parameters, e.g. /video_feed?scale=2&fps=10"""
+    return Response(gen(Camera(), StreamOptions(request.args)),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
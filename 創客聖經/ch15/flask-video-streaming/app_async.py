@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+from importlib import import_module
+import os
+from async_streaming import StreamingServer
+
+# import camera driver
+if os.environ.get('CAMERA'):
+    Camera = import_module('camera_' + os.environ['CAMERA']).Camera
+else:
+    from camera import Camera
+
+# Raspberry Pi camera module (requires picamera package)
+# from camera_pi import Camera
+# Raspberry Pi camera module, JPEGs encoded by the camera pipeline (requires picamera2)
+# from camera_picamera2_mjpeg import Camera
+
+# same pages as app.py, but one asyncio task per viewer instead of one thread
+app = StreamingServer(Camera)
+
+
+@app.route('/')
+async def index(request):
+    """Video streaming home page."""
+    return app.render_template('index.html')
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0')
@@ -1,5 +1,10 @@
 import time
 import threading
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None  # no renditions, every client gets the camera's JPEG
 try:
     from greenlet import getcurrent as get_ident
 except ImportError:
@@ -9,56 +14,178 @@ except ImportError:
         from _thread import get_ident
 
 
-class CameraEvent(object):
-    """An Event-like class that signals all active clients when a new frame is
-    available.
+class FrameBroadcaster(object):
+    """Holds the newest frame once, tagged with a sequence number, for all
+    clients. Each client waits for a frame newer than the last one it sent, so
+    a slow client skips frames instead of holding anyone up, and publishing a
+    frame costs the same whatever the number of clients.
     """
-    def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # this is a new client
-            # add an entry for it in the self.events dict
-            # each entry has two elements, a threading.Event() and a timestamp
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
+    def __init__(self, timeout=5):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.clients = {}  # client ident -> time it last asked for a frame
+        self.timeout = timeout  # seconds before a silent client is evicted
+        self.last_evict = time.time()
+
+    def wait(self, last_seq=0, timeout=None):
+        """Invoked from each client's thread, returns (seq, frame) of the
+        newest frame once it is newer than last_seq, or the current one after
+        timeout seconds."""
+        with self.condition:
+            self.clients[get_ident()] = time.time()
+            self.condition.wait_for(lambda: self.seq > last_seq, timeout)
+            return self.seq, self.frame
+
+    def publish(self, frame):
         """Invoked by the camera thread when a new frame is available."""
         now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():
-                # if this client's event is not set, then set it
-                # also update the last set timestamp to now
-                event[0].set()
-                event[1] = now
-            else:
-                # if the client's event is already set, it means the client
-                # did not process a previous frame
-                # if the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            del self.events[remove]
-
-    def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        self.events[get_ident()][0].clear()
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.condition.notify_all()
+            if now - self.last_evict > 1:
+                self.evict(now)
+
+    def evict(self, now):
+        # drop every client that has not asked for a frame in timeout
+        # seconds, in one pass (called with the condition held)
+        stale = [ident for ident, last in self.clients.items() if now - last > self.timeout]
+        for ident in stale:
+            del self.clients[ident]
+        self.last_evict = now
+
+    def viewers(self):
+        with self.condition:
+            return len(self.clients)
+
+
+class Slot(object):
+    """One cached value of the current frame and the lock of whoever makes it."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+
+
+class RenditionCache(object):
+    """Smaller or lower quality JPEGs of the current frame. Each (scale,
+    quality) rendition is encoded once per frame and shared by every client
+    that asks for it, and the frame is decoded once per scale.
+    """
+    reduced = {2: 'IMREAD_REDUCED_COLOR_2', 4: 'IMREAD_REDUCED_COLOR_4', 8: 'IMREAD_REDUCED_COLOR_8'}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.slots = {}
+
+    def slot(self, seq, key):
+        with self.lock:
+            if seq > self.seq:
+                self.seq = seq
+                self.slots = {}
+            elif seq < self.seq:
+                return Slot()  # a client still on an older frame, not cached
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = Slot()
+            return slot
+
+    def get(self, seq, frame, scale=1, quality=None):
+        """Returns frame (the camera's JPEG number seq) at 1/scale size and
+        JPEG quality (None: OpenCV's default)."""
+        if cv2 is None or (scale == 1 and quality is None):
+            return frame
+        slot = self.slot(seq, (scale, quality))
+        with slot.lock:
+            if slot.data is None:
+                params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+                slot.data = cv2.imencode('.jpg', self.decoded(seq, frame, scale), params)[1].tobytes()
+            return slot.data
+
+    def decoded(self, seq, frame, scale):
+        slot = self.slot(seq, scale)
+        with slot.lock:
+            if slot.data is None:
+                buffer = np.frombuffer(frame, np.uint8)
+                if scale in self.reduced:
+                    # the JPEG decoder scales down while decoding, much cheaper than resizing
+                    slot.data = cv2.imdecode(buffer, getattr(cv2, self.reduced[scale]))
+                else:
+                    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+                    height, width = image.shape[:2]
+                    if scale > 1:
+                        image = cv2.resize(image, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+                    slot.data = image
+            return slot.data
+
+
+def _number(args, name, cast, low, high):
+    try:
+        return min(max(cast(args.get(name)), low), high)
+    except (TypeError, ValueError):
+        return None
+
+
+class StreamOptions(object):
+    """What one client asked for in the /video_feed query string:
+    scale=2 (1/2 size), quality=60 (JPEG quality), fps=10 (at most 10 frames
+    per second), or adapt=1 to step along the ladder of (scale, quality) by
+    how long the client takes to send each frame.
+    """
+    ladder = ((1, None), (1, 60), (2, 60), (2, 40), (4, 40))
+
+    def __init__(self, args=None):
+        args = args or {}
+        self.scale = _number(args, 'scale', int, 1, 8) or 1
+        self.quality = _number(args, 'quality', int, 5, 100)
+        self.max_fps = _number(args, 'fps', float, 0.1, 100)
+        self.adapt = args.get('adapt') == '1'
+        self.step = 0
+        self.slow = 0
+        self.fast = 0
+
+    def rendition(self):
+        if self.adapt:
+            return self.ladder[self.step]
+        return self.scale, self.quality
+
+    def sent(self, seconds):
+        """How long the last frame took to send: three slow frames in a row
+        step down the ladder, thirty fast ones step back up."""
+        if not self.adapt:
+            return
+        budget = 1.0 / (self.max_fps or 15)
+        if seconds > budget:
+            self.slow, self.fast = self.slow + 1, 0
+        elif seconds < budget / 4:
+            self.slow, self.fast = 0, self.fast + 1
+        else:
+            self.slow = self.fast = 0
+        if self.slow >= 3 and self.step < len(self.ladder) - 1:
+            self.step += 1
+            self.slow = 0
+        elif self.fast >= 30 and self.step > 0:
+            self.step -= 1
+            self.fast = 0
 
 
 class BaseCamera(object):
     thread = None  # background thread that reads frames from camera
-    frame = None  # current frame is stored here by background thread
     last_access = 0  # time of last client access to the camera
-    event = CameraEvent()
+    broadcaster = FrameBroadcaster()  # current frame is published here by background thread
+    renditions = RenditionCache()  # scaled / re-encoded versions of it, shared by clients
+    # the frame generators a camera offers, cheapest first, e.g. JPEG straight
+    # from the hardware before frames encoded in Python. The first one that
+    # delivers a frame is used, a source this hardware cannot provide raises
+    # before its first frame
+    sources = ('frames',)
+    source = None  # name of the source in use
 
     def __init__(self):
         """Start the background camera thread if it isn't running yet."""
+        self.last_seq = 0  # newest frame this client got, one Camera per client
+        self.last_return = 0
         if BaseCamera.thread is None:
             BaseCamera.last_access = time.time()
 
@@ -70,29 +197,53 @@ class BaseCamera(object):
             while self.get_frame() is None:
                 time.sleep(0)
 
-    def get_frame(self):
-        """Return the current camera frame."""
-        BaseCamera.last_access = time.time()
+    def get_frame(self, options=None):
+        """Return the newest camera frame this client has not seen yet, as
+        the rendition options (a StreamOptions) asks for."""
+        now = time.time()
+        BaseCamera.last_access = now
+        if options is not None and self.last_return:
+            # the client's generator sent the previous frame in the meantime
+            options.sent(now - self.last_return)
+            if options.max_fps:
+                time.sleep(max(self.last_return + 1.0 / options.max_fps - now, 0))
 
         # wait for a signal from the camera thread
-        BaseCamera.event.wait()
-        BaseCamera.event.clear()
-
-        return BaseCamera.frame
+        self.last_seq, frame = BaseCamera.broadcaster.wait(self.last_seq, timeout=10)
+        if options is not None and frame is not None:
+            frame = BaseCamera.renditions.get(self.last_seq, frame, *options.rendition())
+        self.last_return = time.time()
+        return frame
 
     @staticmethod
     def frames():
         """"Generator that returns frames from the camera."""
         raise RuntimeError('Must be implemented by subclasses.')
 
+    @classmethod
+    def negotiate(cls):
+        """Open the cheapest source that works, returns its first frame and
+        the generator."""
+        for name in cls.sources:
+            try:
+                frames_iterator = getattr(cls, name)()
+                frame = next(frames_iterator)
+            except Exception as e:
+                print('Camera source %s not available: %s' % (name, e))
+                continue
+            print('Camera source: %s' % name)
+            BaseCamera.source = name
+            return frame, frames_iterator
+        raise RuntimeError('Could not start camera.')
+
     @classmethod
     def _thread(cls):
         """Camera background thread."""
         print('Starting camera thread.')
-        frames_iterator = cls.frames()
+        frame, frames_iterator = cls.negotiate()
+        BaseCamera.broadcaster.publish(frame)
         for frame in frames_iterator:
-            BaseCamera.frame = frame
-            BaseCamera.event.set()  # send signal to clients
+            BaseCamera.broadcaster.publish(frame)  # send signal to clients
             time.sleep(0)
 
             # if there hasn't been any clients asking for frames in
@@ -1,11 +1,24 @@
+import os
 import time
 from base_camera import BaseCamera
 
 
 class Camera(BaseCamera):
     """An emulated camera implementation that streams a repeated sequence of
-    files 1.jpg, 2.jpg and 3.jpg at a rate of one frame per second."""
+    files 1.jpg, 2.jpg and 3.jpg at a rate of one frame per second.
+    It offers the same sources as the real backends, the pre-encoded one
+    can be switched off with EMULATED_CAMERA_MJPEG=0 to try the fallback."""
     imgs = [open(f + '.jpg', 'rb').read() for f in ['1', '2', '3']]
+    sources = ('mjpeg_frames', 'frames')
+
+    @staticmethod
+    def mjpeg_frames():
+        """Stands in for JPEGs that come encoded from the camera."""
+        if os.environ.get('EMULATED_CAMERA_MJPEG') == '0':
+            raise RuntimeError('MJPEG source switched off.')
+        while True:
+            time.sleep(1)
+            yield Camera.imgs[int(time.time()) % 3]
 
     @staticmethod
     def frames():
@@ -5,6 +5,7 @@ from base_camera import BaseCamera
 
 class Camera(BaseCamera):
     video_source = 0
+    sources = ('mjpeg_frames', 'frames')
 
     def __init__(self):
         if os.environ.get('OPENCV_CAMERA_SOURCE'):
@@ -15,6 +16,32 @@ class Camera(BaseCamera):
     def set_video_source(source):
         Camera.video_source = source
 
+    @staticmethod
+    def mjpeg_frames():
+        """JPEGs as the webcam sends them in MJPEG mode, nothing is decoded
+        or encoded on the Pi."""
+        camera = cv2.VideoCapture(Camera.video_source, cv2.CAP_V4L2)
+        if not camera.isOpened():
+            raise RuntimeError('Could not start camera.')
+        try:
+            camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)  # read() returns the compressed buffer
+            fourcc = int(camera.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little')
+            if fourcc != b'MJPG':
+                raise RuntimeError('Camera has no MJPEG mode (%r).' % fourcc)
+
+            ret, buffer = camera.read()
+            # some builds ignore CONVERT_RGB and still decode, check it is a JPEG
+            if not ret or buffer.tobytes()[:2] != b'\xff\xd8':
+                raise RuntimeError('Camera did not return JPEG data.')
+
+            while ret:
+                yield buffer.tobytes()
+                ret, buffer = camera.read()
+            raise RuntimeError('Camera stopped.')
+        finally:
+            camera.release()
+
     @staticmethod
     def frames():
         camera = cv2.VideoCapture(Camera.video_source)
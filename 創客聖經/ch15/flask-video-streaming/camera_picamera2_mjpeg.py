@@ -0,0 +1,54 @@
+import io
+import threading
+from picamera2 import Picamera2
+from picamera2.encoders import MJPEGEncoder, JpegEncoder
+from picamera2.outputs import FileOutput
+from base_camera import BaseCamera
+
+
+class StreamingOutput(io.BufferedIOBase):
+    """Receives each JPEG from the encoder thread, the newest one is kept."""
+    def __init__(self):
+        self.frame = None
+        self.condition = threading.Condition()
+
+    def write(self, buf):
+        with self.condition:
+            self.frame = buf
+            self.condition.notify_all()
+
+
+class Camera(BaseCamera):
+    """Pi camera module through Picamera2, the frames leave the camera
+    pipeline already encoded: by the hardware MJPEG encoder where the Pi has
+    one, or else by Picamera2's JPEG encoder. Python only passes the bytes on."""
+    size = (640, 480)
+    sources = ('mjpeg_frames', 'jpeg_frames')
+
+    @staticmethod
+    def recorded_frames(encoder):
+        camera = Picamera2()
+        try:
+            camera.configure(camera.create_video_configuration(main={"size": Camera.size}))
+            output = StreamingOutput()
+            camera.start_recording(encoder, FileOutput(output))
+            try:
+                while True:
+                    with output.condition:
+                        output.condition.wait()
+                        frame = output.frame
+                    yield frame
+            finally:
+                camera.stop_recording()
+        finally:
+            camera.close()
+
+    @staticmethod
+    def mjpeg_frames():
+        """Hardware encoder (V4L2 M2M), not on a Pi 5."""
+        return Camera.recorded_frames(MJPEGEncoder())
+
+    @staticmethod
+    def jpeg_frames():
+        """Software encoder in Picamera2's own thread."""
+        return Camera.recorded_frames(JpegEncoder())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Opens many /video_feed connections to a local streaming server (app.py or
+app_async.py) and reports the frames per second each client received, and
+the memory and thread count of the server process.
+
+    python load_test.py --clients 200 --seconds 20 --pid <server pid>
+    python load_test.py --query "scale=2&quality=60"
+"""
+import argparse
+import asyncio
+import time
+
+BOUNDARY = b'--frame\r\n'
+
+
+async def client(host, port, query, seconds, counts, sizes, index):
+    reader, writer = await asyncio.open_connection(host, port)
+    path = '/video_feed?' + query if query else '/video_feed'
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, host)).encode('latin-1'))
+    await writer.drain()
+    end = time.monotonic() + seconds
+    tail = b''
+    try:
+        while time.monotonic() < end:
+            chunk = await asyncio.wait_for(reader.read(65536), end - time.monotonic())
+            if not chunk:
+                break
+            # a boundary can be split between two reads
+            data = tail + chunk
+            counts[index] += data.count(BOUNDARY)
+            sizes[index] += len(chunk)
+            tail = data[-(len(BOUNDARY) - 1):]
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+
+
+def process_status(pid):
+    """VmRSS in kB and the thread count of a process, from /proc."""
+    status = {}
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.split()[0] if value.split() else ''
+    return int(status['VmRSS']), int(status['Threads'])
+
+
+async def sample_server(pid, seconds, samples):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        samples.append(process_status(pid))
+        await asyncio.sleep(1)
+
+
+async def run(args):
+    counts = [0] * args.clients
+    sizes = [0] * args.clients
+    tasks = []
+    for i in range(args.clients):
+        tasks.append(asyncio.ensure_future(client(args.host, args.port, args.query, args.seconds, counts, sizes, i)))
+        await asyncio.sleep(args.ramp / args.clients)  # do not flood the listen backlog
+    samples = []
+    if args.pid:
+        await sample_server(args.pid, args.seconds, samples)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    fps = sorted(count / float(args.seconds) for count in counts)
+    print('%d clients, %d failed, %d s' % (args.clients, failed, args.seconds))
+    print('fps per client: min %.1f, median %.1f, mean %.1f, max %.1f' % (
+        fps[0], fps[len(fps) // 2], sum(fps) / len(fps), fps[-1]))
+    print('received %.1f KB/s per client, %.1f KB per frame' % (
+        sum(sizes) / 1024.0 / args.seconds / args.clients, sum(sizes) / 1024.0 / max(sum(counts), 1)))
+    if samples:
+        print('server: peak rss %.1f MB, peak threads %d' % (
+            max(rss for rss, _ in samples) / 1024.0, max(threads for _, threads in samples)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--query', default='', help='video_feed parameters, e.g. "scale=2&fps=10"')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--ramp', type=float, default=2.0, help='seconds to open all connections')
+    parser.add_argument('--pid', type=int, default=0, help='server process to report memory of')
+    args = parser.parse_args()
+    asyncio.run(run(args))
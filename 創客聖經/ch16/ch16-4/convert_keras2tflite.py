@@ -1,6 +1,35 @@
+import json
+import os
+import numpy as np
 import tensorflow as tf
 
+_INT8 = False  # also write a fully int8 quantized model, needs a dataset built by dataset_builder.py
+_DATASET = os.path.join('model_result', 'dataset')
+
 model = tf.keras.models.load_model('model_result\lane_navigation.h5')
 converter = tf.lite.TFLiteConverter.from_keras_model(model)
 tflite_model = converter.convert()
-open("model_result\lane_navigation.tflite", "wb").write(tflite_model)
\ No newline at end of file
+open("model_result\lane_navigation.tflite", "wb").write(tflite_model)
+
+
+def representative_dataset(count=300):
+    # preprocessed frames of the training data, normalized like img_preprocess
+    with open(os.path.join(_DATASET, 'manifest.json')) as f:
+        shards = json.load(f)['shards']
+    frames = np.concatenate([np.load(os.path.join(_DATASET, shard['frames']), mmap_mode='r')[::10]
+                             for shard in shards])
+    for i in np.random.permutation(len(frames))[:count]:
+        yield [frames[i:i+1].astype(np.float32) / 255]
+
+
+if _INT8:
+    # int8 input and output: EndToEndLaneFollower quantizes the pixels with a lookup
+    # table and dequantizes the angle, no float math is left on the Pi
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    tflite_model = converter.convert()
+    open("model_result\lane_navigation_int8.tflite", "wb").write(tflite_model)
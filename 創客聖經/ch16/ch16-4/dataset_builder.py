@@ -0,0 +1,134 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from hand_coded_lane_follower import HandCodedLaneFollower
+from end_to_end_lane_follower import img_preprocess_uint8
+
+# Training data for the end-to-end model: every recorded video is labeled by
+# the hand coded lane follower and stored as shards of preprocessed frames,
+#   <i>_<video>_<n>.frames.npy  uint8 (frames, 66, 200, 3), already cropped, YUV, blurred, resized
+#   <i>_<video>_<n>.angles.npy  int16 (frames,), the steering angle of each frame
+# plus manifest.json listing all shards. i is the video's position in the
+# input list, so videos with the same file name in different directories do
+# not overwrite each other's shards. np.load(..., mmap_mode='r') maps a
+# shard without reading it, so training streams the data instead of loading
+# thousands of PNGs
+
+_SHARD_SIZE = 1000  # frames per shard, about 40 MB
+
+
+def label_video(video_file, out_dir, shard_size=_SHARD_SIZE, index=0):
+    """ Runs in a worker process: label one video (number index of the input list), returns its list of shards """
+    name = '%03d_%s' % (index, os.path.splitext(os.path.basename(video_file))[0])
+    lane_follower = HandCodedLaneFollower(control_only=True)
+    cap = cv2.VideoCapture(video_file)
+    frames = np.empty((shard_size, 66, 200, 3), np.uint8)
+    angles = np.empty(shard_size, np.int16)
+    shards = []
+    count = 0
+
+    def save_shard():
+        prefix = os.path.join(out_dir, '%s_%03d' % (name, len(shards)))
+        np.save(prefix + '.frames.npy', frames[:count])
+        np.save(prefix + '.angles.npy', angles[:count])
+        shards.append({'video': video_file, 'frames': os.path.basename(prefix) + '.frames.npy',
+                       'angles': os.path.basename(prefix) + '.angles.npy', 'count': count})
+
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            angle, _ = lane_follower.follow_lane(frame)
+            frames[count] = img_preprocess_uint8(frame)
+            angles[count] = angle
+            count += 1
+            if count == shard_size:
+                save_shard()
+                count = 0
+        if count:
+            save_shard()
+    finally:
+        cap.release()
+    return shards
+
+
+def build_dataset(video_files, out_dir, processes=None, shard_size=_SHARD_SIZE):
+    """
+    Label video_files in a pool of worker processes, one video per task
+    (the stabilized angle depends on the previous frames, so a video is
+    labeled in order), and write the shards and manifest.json to out_dir
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    start = time.monotonic()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.starmap(label_video, [(video_file, out_dir, shard_size, index)
+                                             for index, video_file in enumerate(video_files)])
+    finally:
+        pool.close()
+        pool.join()
+    shards = [shard for video_shards in results for shard in video_shards]
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({'shape': [66, 200, 3], 'shards': shards}, f, indent=1)
+    total = sum(shard['count'] for shard in shards)
+    logging.info('%d videos, %d frames in %d shards, %.1f s' % (
+        len(video_files), total, len(shards), time.monotonic() - start))
+    return shards
+
+
+def load_dataset(out_dir):
+    """ Returns [(frames, angles)] of every shard, memory-mapped """
+    with open(os.path.join(out_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    return [(np.load(os.path.join(out_dir, shard['frames']), mmap_mode='r'),
+             np.load(os.path.join(out_dir, shard['angles']), mmap_mode='r'))
+            for shard in manifest['shards']]
+
+
+def batch_generator(out_dir, batch_size=100, shuffle=True):
+    """
+    Endless (X, y) batches for training, normalized like img_preprocess.
+    Only the frames of the current batch are read from disk
+    """
+    shards = load_dataset(out_dir)
+    index = np.array([(i, j) for i, (_, angles) in enumerate(shards) for j in range(len(angles))])
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1, not %d' % batch_size)
+    if len(index) < batch_size:
+        raise ValueError('%s holds %d frames, not enough for a batch of %d' % (out_dir, len(index), batch_size))
+    while True:
+        if shuffle:
+            np.random.shuffle(index)
+        for start in range(0, len(index) - batch_size + 1, batch_size):
+            batch = index[start:start + batch_size]
+            X = np.stack([shards[i][0][j] for i, j in batch]).astype(np.float32) / 255
+            y = np.array([shards[i][1][j] for i, j in batch], np.float32)
+            yield X, y
+
+
+############################
+# Test Functions
+############################
+def test_dataset(out_dir):
+    shards = load_dataset(out_dir)
+    frames = sum(len(angles) for _, angles in shards)
+    logging.info('%d shards, %d frames' % (len(shards), frames))
+    if frames == 0:
+        return
+    X, y = next(batch_generator(out_dir, batch_size=min(frames, 100)))
+    logging.info('batch %s %s, angles %d..%d' % (X.shape, X.dtype, y.min(), y.max()))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    # python3 dataset_builder.py <out_dir> <video.avi> [<video.avi> ...]
+    build_dataset(sys.argv[2:], sys.argv[1])
+    test_dataset(sys.argv[1])
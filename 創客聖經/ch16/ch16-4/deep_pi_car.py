@@ -2,10 +2,22 @@ import logging
 from pi_car_motor import MotorControl
 import cv2
 import datetime
+import time
 from hand_coded_lane_follower import HandCodedLaneFollower
 from objects_on_road_processor import ObjectsOnRoadProcessor
+from frame_pipeline import LatestFrameGrabber, FrameWorker, StageLatency, ControlRate
+from video_recorder import VideoRecorder
+from telemetry import TelemetryLog
 
 _SHOW_IMAGE = True
+_RECORD_LANE_VIDEO = True  # the lane overlay is only drawn when shown or recorded
+_LATENCY_LOG_INTERVAL = 5  # seconds between latency reports
+_DETECT_OBJECTS = True  # run the object detector next to the lane follower, in its own thread
+_DETECT_INTERVAL = 0.2  # seconds between object detections, steering runs on every frame
+_RECORD_OBJECTS_VIDEO = False
+_RECORD_RAW = False  # record uncompressed frames, encode them later with video_recorder.encode_raw_video
+_RECORD_EVERY = 1    # record every Nth frame
+_RECORD_TELEMETRY = True  # one record per frame: lane lines, angles, speed, timings, see telemetry.py
 
 class DeepPiCar(object):
 
@@ -23,23 +35,35 @@ class DeepPiCar(object):
 
         self.motor = MotorControl()
         
-        self.lane_follower = HandCodedLaneFollower(self)
+        self.lane_follower = HandCodedLaneFollower(self, control_only=True)
         #from end_to_end_lane_follower import EndToEndLaneFollower
-        #self.lane_follower = EndToEndLaneFollower(self)
+        #self.lane_follower = EndToEndLaneFollower(self, control_only=True)
         
         self.traffic_sign_processor = ObjectsOnRoadProcessor(self)
        
 
-        self.fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        # videos are written by the recorder's own threads, a slow SD card only drops frames
+        self.latency = StageLatency()
+        self.recorder = VideoRecorder(self.latency)
         datestr = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
-        self.video_orig = self.create_video_recorder('../data/tmp/car_video%s.avi' % datestr)
-        self.video_lane = self.create_video_recorder('../data/tmp/car_video_lane%s.avi' % datestr)
-        self.video_objs = self.create_video_recorder('../data/tmp/car_video_objs%s.avi' % datestr)
+        self.create_video_recorder('video_orig', '../data/tmp/car_video%s' % datestr)
+        if _RECORD_LANE_VIDEO:
+            self.create_video_recorder('video_lane', '../data/tmp/car_video_lane%s' % datestr)
+        if _RECORD_OBJECTS_VIDEO:
+            self.create_video_recorder('video_objs', '../data/tmp/car_video_objs%s' % datestr)
+
+        self.grabber = None
+        self.workers = []
+        self.image_objs = None
+        self.telemetry = TelemetryLog('../data/tmp/car_telemetry%s.tlm' % datestr,
+                                      ('follow_lane', 'glass_to_motor')) if _RECORD_TELEMETRY else None
 
         logging.info('Created a DeepPiCar')
 
-    def create_video_recorder(self, path):
-        return cv2.VideoWriter(path, self.fourcc, 20.0, (self.__SCREEN_WIDTH, self.__SCREEN_HEIGHT))
+    def create_video_recorder(self, name, path):
+        path += '.raw' if _RECORD_RAW else '.avi'
+        self.recorder.add_stream(name, path, (self.__SCREEN_WIDTH, self.__SCREEN_HEIGHT),
+                                 every=_RECORD_EVERY, raw=_RECORD_RAW)
 
     def __enter__(self):
         """ Entering a with statement """
@@ -56,11 +80,14 @@ class DeepPiCar(object):
     def cleanup(self):
         """ Reset the hardware"""
         logging.info('Stopping the car, resetting hardware.')
+        # join the detector first, it could still change the speed after motor.stop()
+        self.stop_pipeline()
         self.motor.stop()
+        self.motor.close()
         self.camera.release()
-        self.video_orig.release()
-        self.video_lane.release()
-        self.video_objs.release()
+        self.recorder.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
         cv2.destroyAllWindows()
 
     def drive(self, speed=__INITIAL_SPEED):
@@ -74,41 +101,90 @@ class DeepPiCar(object):
         
         fps = int(self.camera.get(5))
         print("Camera fps:", fps)
-        
-        target = 5   # 1/6    
-        counter = 0
-        
-        while self.camera.isOpened():
-            if counter == target: 
-                ret, image_lane = self.camera.read()
-                counter = 0
-            else:
-                ret = self.camera.grab() 
-                counter += 1
-                continue
-            if not ret:
-                break                    
-            image_objs = image_lane.copy()
-            self.video_orig.write(image_lane)
-
-        #    image_objs = self.process_objects_on_road(image_objs)
-        #    self.video_objs.write(image_objs)
-        #    show_image('Detected Objects', image_objs)
+
+        # the camera is read in its own thread and the videos are written in
+        # their own threads, this loop processes the newest frame whenever it
+        # is free, frames that arrive in the meantime are simply replaced
+        self.grabber = LatestFrameGrabber(self.camera.read).start(self.latency)
+
+        # the detector reads the same frames and only changes the speed, the lane
+        # follower only steers, the motor merges both into one command
+        if _DETECT_OBJECTS:
+            self.workers = [FrameWorker(self.grabber, self.process_objects_on_road, 'detect_objects',
+                                        _DETECT_INTERVAL, self.latency).start()]
+
+        seq = 0
+        last_report = time.monotonic()
+        control_rate = ControlRate(self.grabber)
+        while True:
+            seq, captured, image_lane = self.grabber.read(seq)
+            if image_lane is None:
+                break
+            failed = [worker for worker in self.workers if worker.error is not None]
+            if failed:
+                # no stop signs, red lights or speed limits any more, do not keep driving blind
+                logging.error('%s failed, stopping the car' % failed[0].name)
+                error = failed[0].error
+                self.cleanup()
+                raise error
+            start = time.monotonic()
+            self.latency.add('frame age', start - captured)
+            control_rate.tick()
+            self.recorder.write('video_orig', image_lane)
 
             image_lane = self.follow_lane(image_lane)
-            self.video_lane.write(image_lane)
+            done = time.monotonic()
+            self.latency.add('follow_lane', done - start)
+            self.latency.add('glass to motor', done - captured)
+            if self.telemetry is not None:
+                self.log_telemetry(captured, seq, {'follow_lane': (done - start) * 1000,
+                                                   'glass_to_motor': (done - captured) * 1000})
+            if _RECORD_LANE_VIDEO:
+                # the rendered overlay is reused by the next frame, the writer needs its own copy
+                self.recorder.write('video_lane', image_lane.copy())
             show_image('Lane Lines', image_lane)
+            if self.image_objs is not None:
+                show_image('Detected Objects', self.image_objs)
+
+            if done - last_report > _LATENCY_LOG_INTERVAL:
+                logging.info(control_rate.summary())
+                logging.info(self.latency.summary())
+                logging.info(self.recorder.summary())
+                last_report = done
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 self.cleanup()
                 break
 
-    def process_objects_on_road(self, image):
-        image = self.traffic_sign_processor.process_objects_on_road(image)
+    def stop_pipeline(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+
+    def process_objects_on_road(self, image, timestamp=None):
+        if not (_SHOW_IMAGE or _RECORD_OBJECTS_VIDEO):
+            self.traffic_sign_processor.process_objects_on_road(image, timestamp, draw=False)
+            return image
+        # the frame is shared with the lane follower, draw on a copy
+        image = self.traffic_sign_processor.process_objects_on_road(image.copy(), timestamp)
+        self.recorder.write('video_objs', image)
+        # imshow only works from the main thread, drive() shows it
+        self.image_objs = image
         return image
 
+    def log_telemetry(self, captured, seq, stage_ms):
+        lane_follower = self.lane_follower
+        self.telemetry.append(captured, seq, getattr(lane_follower, 'lane_lines', []),
+                              getattr(lane_follower, 'proposed_steering_angle', lane_follower.curr_steering_angle),
+                              lane_follower.curr_steering_angle, self.traffic_sign_processor.speed, stage_ms)
+
     def follow_lane(self, image):
-        image = self.lane_follower.follow_lane(image)
+        self.lane_follower.follow_lane(image)
+        if _SHOW_IMAGE or _RECORD_LANE_VIDEO:
+            image = self.lane_follower.render(image)
         return image
 
 
@@ -1,12 +1,19 @@
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
 import logging
 from pi_car_motor import MotorControl
 import cv2
 import datetime
+import time
 from hand_coded_lane_follower import HandCodedLaneFollower
 from objects_on_road_processor import ObjectsOnRoadProcessor
+from frame_pipeline import LatestFrameGrabber, StageLatency, ControlRate
+from video_recorder import VideoRecorder
 
 _SHOW_IMAGE = True
+_RECORD_LANE_VIDEO = True  # the lane overlay is only drawn when shown or recorded
+_RECORD_RAW = False  # record uncompressed frames, encode them later with video_recorder.encode_raw_video
+_RECORD_EVERY = 1    # record every Nth frame
+_LATENCY_LOG_INTERVAL = 5  # seconds between control rate and latency reports
 
 class DeepPiCar(object):
 
@@ -26,23 +33,28 @@ class DeepPiCar(object):
 
         self.motor = MotorControl()
         
-        self.lane_follower = HandCodedLaneFollower(self)
+        self.lane_follower = HandCodedLaneFollower(self, control_only=True)
         #from end_to_end_lane_follower import EndToEndLaneFollower
-        #self.lane_follower = EndToEndLaneFollower(self)
+        #self.lane_follower = EndToEndLaneFollower(self, control_only=True)
         
         self.traffic_sign_processor = ObjectsOnRoadProcessor(self)
        
 
-        self.fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        # videos are written by the recorder's own threads, a slow SD card only drops frames
+        self.latency = StageLatency()
+        self.recorder = VideoRecorder(self.latency)
+        self.grabber = None
         datestr = datetime.datetime.now().strftime("%y%m%d_%H%M%S")
-        self.video_orig = self.create_video_recorder('../data/tmp/car_video%s.avi' % datestr)
-        self.video_lane = self.create_video_recorder('../data/tmp/car_video_lane%s.avi' % datestr)
-        self.video_objs = self.create_video_recorder('../data/tmp/car_video_objs%s.avi' % datestr)
+        self.create_video_recorder('video_orig', '../data/tmp/car_video%s' % datestr)
+        if _RECORD_LANE_VIDEO:
+            self.create_video_recorder('video_lane', '../data/tmp/car_video_lane%s' % datestr)
 
         logging.info('Created a DeepPiCar')
 
-    def create_video_recorder(self, path):
-        return cv2.VideoWriter(path, self.fourcc, 20.0, (self.__SCREEN_WIDTH, self.__SCREEN_HEIGHT))
+    def create_video_recorder(self, name, path):
+        path += '.raw' if _RECORD_RAW else '.avi'
+        self.recorder.add_stream(name, path, (self.__SCREEN_WIDTH, self.__SCREEN_HEIGHT),
+                                 every=_RECORD_EVERY, raw=_RECORD_RAW)
 
     def __enter__(self):
         """ Entering a with statement """
@@ -60,10 +72,12 @@ class DeepPiCar(object):
         """ Reset the hardware"""
         logging.info('Stopping the car, resetting hardware.')
         self.motor.stop()
+        self.motor.close()
+        if self.grabber is not None:
+            self.grabber.stop()  # before the camera, the capture thread may wait for a frame
+            self.grabber = None
         self.camera.stop()
-        self.video_orig.release()
-        self.video_lane.release()
-        self.video_objs.release()
+        self.recorder.close()
         cv2.destroyAllWindows()
 
     def drive(self, speed=__INITIAL_SPEED):
@@ -80,30 +94,50 @@ class DeepPiCar(object):
         fps = 1e6 / frame_duration  # 將微秒轉換為秒並計算 FPS
         print("Camera fps:", fps)
         
-        target = 5   # 1/6    
-        counter = 0
-        
+        # the capture thread only keeps the newest completed request, a buffer
+        # still owned by the camera. Requests replaced before this loop gets to
+        # them go straight back to the camera: a skipped frame is never copied
+        # or color converted, and the loop always works on the freshest frame
+        self.grabber = LatestFrameGrabber(lambda: (True, self.camera.capture_request()),
+                                          release=lambda request: request.release()).start(self.latency)
+
+        seq = 0
+        last_report = time.monotonic()
+        control_rate = ControlRate(self.grabber)
         while True:
-            image_lane = self.camera.capture_array()
-            image_lane = cv2.cvtColor(image_lane, cv2.COLOR_RGB2BGR)
-            if image_lane is None:
+            seq, captured, request = self.grabber.read(seq)
+            if request is None:
                 break
-            if counter == target: 
-                counter = 0
-            else: 
-                counter += 1
-                continue
-            image_objs = image_lane.copy()
-            self.video_orig.write(image_lane)
-
-        #    image_objs = self.process_objects_on_road(image_objs)
-        #    self.video_objs.write(image_objs)
+            start = time.monotonic()
+            self.latency.add('frame age', start - captured)
+            control_rate.tick()
+            try:
+                # one pass from the camera buffer to a BGR frame
+                with MappedArray(request, 'main') as mapped:
+                    image_lane = cv2.cvtColor(mapped.array, cv2.COLOR_RGB2BGR)
+            finally:
+                request.release()
+            self.recorder.write('video_orig', image_lane)
+
+        #    image_objs = self.process_objects_on_road(image_lane.copy())
+        #    self.recorder.write('video_objs', image_objs)
         #    show_image('Detected Objects', image_objs)
 
             image_lane = self.follow_lane(image_lane)
-            self.video_lane.write(image_lane)
+            done = time.monotonic()
+            self.latency.add('follow_lane', done - start)
+            self.latency.add('glass to motor', done - captured)
+            if _RECORD_LANE_VIDEO:
+                # the rendered overlay is reused by the next frame, the writer needs its own copy
+                self.recorder.write('video_lane', image_lane.copy())
             show_image('Lane Lines', image_lane)
 
+            if done - last_report > _LATENCY_LOG_INTERVAL:
+                logging.info(control_rate.summary())
+                logging.info(self.latency.summary())
+                logging.info(self.recorder.summary())
+                last_report = done
+
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 self.cleanup()
                 break
@@ -113,7 +147,9 @@ class DeepPiCar(object):
         return image
 
     def follow_lane(self, image):
-        image = self.lane_follower.follow_lane(image)
+        self.lane_follower.follow_lane(image)
+        if _SHOW_IMAGE or _RECORD_LANE_VIDEO:
+            image = self.lane_follower.render(image)
         return image
 
 
@@ -2,7 +2,8 @@ import cv2
 import numpy as np
 import logging
 import math
-from tflite_runtime.interpreter import Interpreter
+import time
+from tflite_utils import load_interpreter, timings_text, InputTensor, get_output
 from hand_coded_lane_follower import HandCodedLaneFollower
 
 _SHOW_IMAGE = False
@@ -11,16 +12,31 @@ data_folder = "model_result/"
 model_path = data_folder + "lane_navigation.tflite"
 
 class EndToEndLaneFollower(object):
+    """
+    With control_only=True follow_lane() returns (steering angle, lane lines)
+    like HandCodedLaneFollower instead of drawing the heading line, the model
+    finds no lane lines so that list is empty. render() draws on demand.
+    compute_steering_angles() runs up to batch_size frames per invoke()
+    """
 
     def __init__(self,
                  car=None,
-                 model_path=model_path):
+                 model_path=model_path,
+                 control_only=False,
+                 num_threads=None,
+                 batch_size=8):
         logging.info('Creating a EndToEndLaneFollower...')
 
         self.car = car
+        self.control_only = control_only
         self.curr_steering_angle = 90
-        self.model = Interpreter(model_path=model_path)
-        self.model.allocate_tensors()
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.model, self.model_timings = load_interpreter(model_path, num_threads)
+        logging.info('Lane navigation model: %s' % timings_text(self.model_timings))
+        self.input = InputTensor(self.model)
+        self.batch_size = batch_size
+        self.batch_model = None  # created by the first compute_steering_angles()
 
     def follow_lane(self, frame):
         # Main entry point of the lane follower
@@ -30,42 +46,85 @@ class EndToEndLaneFollower(object):
         logging.debug("curr_steering_angle = %d" % self.curr_steering_angle) 
         if self.car is not None:
             self.car.motor.turn_angle(angle=self.curr_steering_angle)
-            
-        final_frame = display_heading_line(frame, self.curr_steering_angle)
+
+        if self.control_only:
+            return self.curr_steering_angle, []
+
+        final_frame = self.render(frame)
 
         return final_frame
 
+    def render(self, frame):
+        return display_heading_line(frame, self.curr_steering_angle)
+
     def compute_steering_angle(self, frame):
         """ Find the steering angle directly based on video frame
             We assume that camera is calibrated to point to dead center
         """
-        preprocessed = img_preprocess(frame)
-        
-        input_details = self.model.get_input_details()
-        output_details = self.model.get_output_details()
-        input_data = np.expand_dims(preprocessed, axis=0)
-        input_data = input_data.astype("float32")
-        self.model.set_tensor(input_details[0]["index"],input_data)
-        
+        img_preprocess_into(frame, self.input)
+
         self.model.invoke()
-        
-        steering_angle = self.model.get_tensor(output_details[0]["index"])
+
+        steering_angle = get_output(self.model, self.input.output_details[0])
         steering_angle = steering_angle[0][0]
 
         #logging.debug('new steering angle: %s' % steering_angle)
         print('new steering angle: %s' % steering_angle)
         return int(steering_angle + 0.5) # round the nearest integer
 
+    def compute_steering_angles(self, frames):
+        """ Steering angles of a list of frames, e.g. a recorded video or two cameras.
+            A second interpreter with its input resized to batch_size frames runs
+            one invoke() per batch_size frames, a short last batch is padded.
+            Does not change curr_steering_angle or steer the car
+        """
+        if self.batch_model is None:
+            self.batch_model, _ = load_interpreter(self.model_path, self.num_threads, warmup_runs=0)
+            detail = self.input.input_details[0]
+            self.batch_model.resize_tensor_input(detail["index"], [self.batch_size] + list(detail["shape"][1:]))
+            self.batch_model.allocate_tensors()
+            self.batch_input = InputTensor(self.batch_model)
+
+        angles = np.empty(len(frames), int)
+        for start in range(0, len(frames), self.batch_size):
+            batch = frames[start:start + self.batch_size]
+            for i, frame in enumerate(batch):
+                img_preprocess_into(frame, self.batch_input, i)
+            self.batch_model.invoke()
+            steering_angles = get_output(self.batch_model, self.batch_input.output_details[0])
+            angles[start:start + len(batch)] = (steering_angles[:len(batch), 0] + 0.5).astype(int)
+        return angles
+
 
 def img_preprocess(image):
+    image = img_preprocess_uint8(image)
+    image = image.astype(np.float32) / 255 # normalizing
+    return image
+
+def img_preprocess_uint8(image):
+    # img_preprocess without the normalization, 66x200x3 uint8, e.g. for storing training data
+    # resized first, so the color conversion and blur only see 200x66 pixels
     height, _, _ = image.shape
     image = image[int(height/2):,:,:]  # remove top half of the image, as it is not relevant for lane following
+    image = cv2.resize(image, (200,66)) # input image size (200,66) Nvidia model
     image = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)  # Nvidia model said it is best to use YUV color space
     image = cv2.GaussianBlur(image, (3,3), 0)
-    image = cv2.resize(image, (200,66)) # input image size (200,66) Nvidia model
-    image = image / 255 # normalizing, the processed image becomes black for some reason.  do we need this?
     return image
 
+def img_preprocess_into(image, input_tensor, index=0):
+    """
+    Same steps as img_preprocess, written into the model input tensor (slot
+    index of a batch) through reused uint8 buffers. For a float model the only
+    float step is the final divide into the tensor, an int8 model gets its
+    input through a lookup table
+    """
+    height, _, _ = image.shape
+    image = image[int(height/2):,:,:]
+    resized = cv2.resize(image, (200,66), dst=input_tensor.buffer('resized', (66, 200, 3)))
+    yuv = cv2.cvtColor(resized, cv2.COLOR_BGR2YUV, dst=input_tensor.buffer('yuv', (66, 200, 3)))
+    blurred = cv2.GaussianBlur(yuv, (3,3), 0, dst=input_tensor.buffer('blurred', (66, 200, 3)))
+    input_tensor.write(blurred, divide_by=255.0, index=index)
+
 def display_heading_line(frame, steering_angle, line_color=(0, 0, 255), line_width=5, ):
     heading_image = np.zeros_like(frame)
     height, width, _ = frame.shape
@@ -148,9 +207,106 @@ def test_video(video_file):
         cv2.destroyAllWindows()
 
 
+def img_preprocess_old(image):
+    # the original preprocessing: full size YUV and blur, resize last, float64
+    height, _, _ = image.shape
+    image = image[int(height/2):,:,:]
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
+    image = cv2.GaussianBlur(image, (3,3), 0)
+    image = cv2.resize(image, (200,66))
+    image = image / 255
+    return image
+
+
+def benchmark_preprocess(video_file, model_path=model_path, int8_model_path=None):
+    """ Per frame preprocessing time, allocations and steering angles on a recorded video:
+        the original img_preprocess_old/expand_dims/astype/set_tensor path against
+        img_preprocess_into, and against a fully int8 model if int8_model_path is given
+    """
+    import tracemalloc
+    cap = cv2.VideoCapture(video_file + '.avi')
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+
+    def old_path(model, input_tensor, frame):
+        input_data = np.expand_dims(img_preprocess_old(frame), axis=0).astype("float32")
+        model.set_tensor(input_tensor.input_details[0]["index"], input_data)
+
+    def new_path(model, input_tensor, frame):
+        img_preprocess_into(frame, input_tensor)
+
+    runs = [('old', model_path, old_path), ('new', model_path, new_path)]
+    if int8_model_path is not None:
+        runs.append(('int8', int8_model_path, new_path))
+    angles = {}
+    for name, path, preprocess in runs:
+        model, _ = load_interpreter(path)
+        input_tensor = InputTensor(model)
+        preprocess(model, input_tensor, frames[0])  # warm up the reused buffers
+        tracemalloc.start()
+        start = time.perf_counter()
+        for frame in frames:
+            preprocess(model, input_tensor, frame)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        angles[name] = []
+        start = time.perf_counter()
+        for frame in frames:
+            preprocess(model, input_tensor, frame)
+            model.invoke()
+            angles[name].append(get_output(model, input_tensor.output_details[0])[0][0])
+        total = time.perf_counter() - start
+        diff = np.abs(np.subtract(angles[name], angles['old']))
+        logging.info("%s: preprocess %.3f ms/frame (peak allocation %.1f KB), with inference %.3f ms/frame, "
+                     "angle vs old mean %.2f max %.2f deg" % (name, elapsed / len(frames) * 1000, peak / 1024.0,
+                                                              total / len(frames) * 1000, diff.mean(), diff.max()))
+
+
+def benchmark_batch(video_file, model_path=model_path, batch_sizes=(1, 2, 4, 8, 16), num_threads=None):
+    """ Frames per second of compute_steering_angles() for each batch size, against
+        compute_steering_angle() one frame at a time. Run it on the Pi, a desktop
+        CPU has much more cache and memory bandwidth per core
+    """
+    cap = cv2.VideoCapture(video_file + '.avi')
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+
+    lane_follower = EndToEndLaneFollower(model_path=model_path, control_only=True, num_threads=num_threads)
+    start = time.perf_counter()
+    single = [lane_follower.compute_steering_angle(frame) for frame in frames]
+    elapsed = time.perf_counter() - start
+    logging.info("single frame: %.1f frames/s" % (len(frames) / elapsed))
+
+    for batch_size in batch_sizes:
+        lane_follower = EndToEndLaneFollower(model_path=model_path, control_only=True,
+                                             num_threads=num_threads, batch_size=batch_size)
+        lane_follower.compute_steering_angles(frames[:batch_size])  # create and warm up the batch interpreter
+        start = time.perf_counter()
+        angles = lane_follower.compute_steering_angles(frames)
+        elapsed = time.perf_counter() - start
+        logging.info("batch %2d: %.1f frames/s, %.2f ms per batch, max angle diff %d deg" % (
+            batch_size, len(frames) / elapsed, elapsed / len(frames) * batch_size * 1000,
+            np.abs(angles - single).max()))
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
+    #benchmark_preprocess("images/video01")
+    #benchmark_batch("images/video01")
+
     test_video("images/video01")
     #test_photo('/home/pi/DeepPiCar/models/lane_navigation/data/images/video01_100_084.png')
     # test_photo(sys.argv[1])
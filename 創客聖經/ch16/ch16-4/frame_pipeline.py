@@ -0,0 +1,317 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+
+class LatestFrameGrabber(object):
+    """
+    Reads the camera in a background thread and only keeps the newest frame,
+    so whoever processes frames always gets the freshest one and never works
+    through a backlog. read is a callable returning (ret, frame), e.g.
+    cv2.VideoCapture.read.
+
+    The frame can also be a camera buffer that is only converted once someone
+    reads it: release is then called on every buffer that was replaced before
+    anyone read it, so a skipped frame costs no copy and no color conversion.
+    With release, the reader owns (and releases) what read() returns
+    """
+
+    def __init__(self, read, name='capture', release=None):
+        self.read_frame = read
+        self.release = release
+        self.name = name
+        self.condition = threading.Condition()
+        self.frame = None
+        self.taken = False
+        self.seq = 0
+        self.skipped = 0  # frames replaced before anyone read them
+        self.timestamp = 0
+        self.running = False
+        self.thread = None
+        self.latency = None
+
+    def start(self, latency=None):
+        # latency: a StageLatency to record the time spent in read()
+        self.latency = latency
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        with self.condition:
+            if self.release is not None and self.frame is not None and not self.taken:
+                self.release(self.frame)
+            self.frame = None
+
+    def _run(self):
+        logging.debug('Starting capture thread')
+        while self.running:
+            start = time.monotonic()
+            ret, frame = self.read_frame()
+            timestamp = time.monotonic()
+            if self.latency is not None:
+                self.latency.add(self.name, timestamp - start)
+            with self.condition:
+                if not ret:
+                    logging.info('Camera returned no frame, stopping capture thread')
+                    self.running = False
+                else:
+                    if self.frame is not None and not self.taken:
+                        self.skipped += 1
+                        if self.release is not None:
+                            self.release(self.frame)
+                    self.frame = frame
+                    self.taken = False
+                    self.seq += 1
+                    self.timestamp = timestamp
+                self.condition.notify_all()
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a frame newer than last_seq, returns (seq, capture timestamp, frame).
+        frame is None once the camera stopped or on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.fresh(last_seq) or not self.running, timeout):
+                return last_seq, None, None
+            if not self.fresh(last_seq):
+                return last_seq, None, None
+            self.taken = True
+            return self.seq, self.timestamp, self.frame
+
+    def fresh(self, last_seq):
+        # with release, a frame can only be handed out once
+        return self.seq > last_seq and not (self.release is not None and self.taken)
+
+
+class FrameWorker(object):
+    """
+    Calls process(frame, timestamp) from its own thread on the newest frame of
+    a LatestFrameGrabber, at most once every interval seconds. Several workers
+    and the main loop can read the same grabber: they all get the same frame
+    array, nothing is copied, so process must not draw on the frame it gets.
+    TFLite and OpenCV release the GIL while they work, so workers run on
+    their own cores. If process raises, the worker logs it, keeps the
+    exception in error and stops: whoever relies on it has to check error
+    """
+
+    def __init__(self, grabber, process, name='worker', interval=0, latency=None):
+        self.grabber = grabber
+        self.process = process
+        self.name = name
+        self.interval = interval
+        self.latency = latency
+        self.stopped = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        self.error = None
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        logging.debug('Starting %s thread' % self.name)
+        seq = 0
+        while not self.stopped.is_set():
+            seq, captured, frame = self.grabber.read(seq, timeout=0.5)
+            if frame is None:
+                if not self.grabber.running:
+                    break
+                continue
+            start = time.monotonic()
+            try:
+                self.process(frame, captured)
+            except Exception as error:
+                logging.exception('%s failed, stopping the thread' % self.name)
+                self.error = error
+                break
+            done = time.monotonic()
+            if self.latency is not None:
+                self.latency.add(self.name, done - start)
+            # run at most once per interval, wake up early on stop()
+            self.stopped.wait(self.interval - (done - start))
+
+
+class FrameQueue(object):
+    """
+    A bounded queue between one producer and one consumer thread. When it is
+    full, put() drops the oldest item, or with block=True waits for room
+    """
+
+    def __init__(self, maxsize=2, block=False):
+        self.items = collections.deque(maxlen=maxsize)
+        self.block = block
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if self.block:
+                self.condition.wait_for(lambda: len(self.items) < self.items.maxlen or self.closed)
+            if self.closed:
+                self.dropped += 1
+                return
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self):
+        # blocks until an item is available, returns None once closed and empty
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FrameWriter(object):
+    """
+    Writes frames to a cv2.VideoWriter (or anything with write(frame)) from its
+    own thread, behind a FrameQueue. block chooses what happens when the queue
+    is full (wait or drop the oldest frame), every=N only records every Nth frame
+    """
+
+    def __init__(self, video_writer, name='writer', maxsize=4, latency=None, block=False, every=1):
+        self.video_writer = video_writer
+        self.name = name
+        self.queue = FrameQueue(maxsize, block)
+        self.latency = latency
+        self.every = every
+        self.offered = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        self.offered += 1
+        if (self.offered - 1) % self.every == 0:
+            self.queue.put(frame)
+
+    def close(self):
+        self.queue.close()
+        self.thread.join()
+        if self.queue.dropped:
+            logging.info('%s dropped %d frames' % (self.name, self.queue.dropped))
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.queue.dropped, 'depth': len(self.queue)}
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            start = time.monotonic()
+            self.video_writer.write(frame)
+            self.written += 1
+            if self.latency is not None:
+                self.latency.add(self.name, time.monotonic() - start)
+
+
+class ControlRate(object):
+    """
+    How often the control loop acts on a frame, next to the camera frame rate
+    of a LatestFrameGrabber and the frames nobody processed. Call tick() once
+    per processed frame, the frame age is recorded by the StageLatency
+    """
+
+    def __init__(self, grabber):
+        self.grabber = grabber
+        self.count = 0
+        self.start = time.monotonic()
+        self.start_seq = grabber.seq
+        self.start_skipped = grabber.skipped
+
+    def tick(self):
+        self.count += 1
+
+    def summary(self, reset=True):
+        now = time.monotonic()
+        elapsed = max(now - self.start, 1e-6)
+        text = 'control rate %.1f Hz, camera %.1f fps, %d frames skipped' % (
+            self.count / elapsed, (self.grabber.seq - self.start_seq) / elapsed,
+            self.grabber.skipped - self.start_skipped)
+        if reset:
+            self.count = 0
+            self.start = now
+            self.start_seq = self.grabber.seq
+            self.start_skipped = self.grabber.skipped
+        return text
+
+
+class StageLatency(object):
+    """ Count, mean and max time of each pipeline stage, safe to add() from any thread """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = collections.OrderedDict()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            stat = self.stats.get(stage)
+            if stat is None:
+                stat = self.stats[stage] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+    def summary(self, reset=True):
+        with self.lock:
+            text = ', '.join('%s %.1f/%.1f ms (n=%d)' % (stage, total / count * 1000, longest * 1000, count)
+                             for stage, (count, total, longest) in self.stats.items())
+            if reset:
+                self.stats.clear()
+        return 'mean/max latency: ' + text
+
+
+def test_worker_error():
+    frames = itertools.count(1)
+    grabber = LatestFrameGrabber(lambda: (True, next(frames)))
+
+    def process(frame, timestamp):
+        raise KeyError('unknown label')
+
+    worker = FrameWorker(grabber, process, 'detect_objects')
+    grabber.start()
+    worker.start()
+    worker.thread.join(5)
+    grabber.stop()
+    assert not worker.thread.is_alive()
+    assert isinstance(worker.error, KeyError), worker.error
+    logging.info('worker error reached the caller: %r' % worker.error)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format='%(levelname)-5s:%(asctime)s: %(message)s')
+
+    test_worker_error()
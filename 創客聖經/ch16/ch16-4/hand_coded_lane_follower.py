@@ -4,6 +4,7 @@ import logging
 import math
 import datetime
 import sys
+import time
 
 _SHOW_IMAGE = False
 _LANE_COLOR = "blue"
@@ -15,115 +16,386 @@ _HEIGHT_OFFSET = 20
 _MID_OFFSET_PERCENT = 0    #0.02
 _CROP_IMAGE = False
 
+# lower and upper HSV bounds of each lane color, None means plain grayscale
+_LANE_COLOR_PROFILES = {
+    "white": None,
+    "black": ((0, 0, 0), (100, 100, 100)),
+    "blue": ((30, 40, 0), (150, 255, 255)),
+    #"blue": ((110, 50, 50), (130, 255, 255)),
+    "yellow": ((25 - 10, 100, 100), (25 + 10, 255, 255)),
+    "red": ((180 - 10, 100, 100), (180 + 10, 255, 255)),
+}
+
 class HandCodedLaneFollower(object):
+    """
+    The images returned by follow_lane() live in self.buffers and are
+    overwritten by the next call, so write or show them before that.
+
+    With control_only=True nothing is drawn: follow_lane() and steer() return
+    (steering angle, lane lines) instead of an image, and render() draws the
+    overlay on demand, e.g. when a debug view or a recorder is attached.
+
+    With tracking=True (or a LaneTracker) the lane lines are followed from
+    frame to frame, see LaneTracker
+    """
 
-    def __init__(self, car=None):
+    def __init__(self, car=None, control_only=False, color_filter=None, tracking=False):
         logging.info('Creating a HandCodedLaneFollower...')
         self.car = car
+        self.control_only = control_only
+        self.color_filter = color_filter if color_filter is not None else LaneColorFilter(_LANE_COLOR)
+        if tracking is True:
+            tracking = LaneTracker()
+        self.tracker = tracking or None
         self.curr_steering_angle = 90
+        self.proposed_steering_angle = 90  # before stabilize_steering_angle
+        self.lane_lines = []
+        self.buffers = FrameBuffers()
+        self.stage_ms = {}  # time spent in each step of the last follow_lane()
 
 
     def follow_lane(self, frame):
         # Main entry point of the lane follower
         show_image("orig", frame)
 
-        lane_lines, frame = detect_lane(frame)
+        start = time.perf_counter()
+        lane_lines, frame = detect_lane(frame, self.buffers, render=not self.control_only,
+                                        color_filter=self.color_filter, tracker=self.tracker)
+        detected = time.perf_counter()
         final_frame = self.steer(frame, lane_lines)
+        self.stage_ms['detect_lane'] = (detected - start) * 1000
+        self.stage_ms['steer'] = (time.perf_counter() - detected) * 1000
 
         return final_frame
 
     def steer(self, frame, lane_lines):
         logging.debug('steering...')
+        self.lane_lines = lane_lines
         if len(lane_lines) == 0:
             logging.error('No lane lines detected, nothing to do.')
+            self.proposed_steering_angle = self.curr_steering_angle
+            if self.control_only:
+                return self.curr_steering_angle, lane_lines
             return frame
 
         new_steering_angle = compute_steering_angle(frame, lane_lines)
-        self.curr_steering_angle = stabilize_steering_angle(self.curr_steering_angle, new_steering_angle, len(lane_lines))
+        self.proposed_steering_angle = new_steering_angle
+        if self.tracker is not None and self.tracker.is_locked():
+            # the tracked lane lines are already filtered, no need to clamp
+            logging.info('Tracked angle: %s' % new_steering_angle)
+            self.curr_steering_angle = new_steering_angle
+        else:
+            self.curr_steering_angle = stabilize_steering_angle(self.curr_steering_angle, new_steering_angle, len(lane_lines))
 
         if self.car is not None:
             self.car.motor.turn_angle(angle=self.curr_steering_angle)
-        
-        curr_heading_image = display_heading_line(frame, self.curr_steering_angle)
+
+        if self.control_only:
+            return self.curr_steering_angle, lane_lines
+
+        curr_heading_image = display_heading_line(frame, self.curr_steering_angle,
+                                                  heading_image=self.buffers.get('line image', frame),
+                                                  dst=self.buffers.get('heading', frame))
         show_image("heading", curr_heading_image)
 
         return curr_heading_image
 
+    def render(self, frame):
+        # Draw the last lane lines and heading on frame, the same image follow_lane() returns when drawing
+        frame = crop_frame(frame)
+        line_image = self.buffers.get('line image', frame)
+        lane_lines_image = display_lines(frame, self.lane_lines, line_image=line_image,
+                                         dst=self.buffers.get('lane lines', frame))
+        if len(self.lane_lines) == 0:
+            return lane_lines_image
+        return display_heading_line(lane_lines_image, self.curr_steering_angle, heading_image=line_image,
+                                    dst=self.buffers.get('heading', frame))
+
+
+class FrameBuffers(object):
+    """
+    Scratch images reused from frame to frame instead of allocating new ones,
+    plus the region of interest mask, built once per frame size
+    """
+
+    def __init__(self):
+        self.images = {}
+        self.roi_masks = {}
+
+    def get(self, name, like, channels=None):
+        # reallocate only if the frame size or type changed
+        shape = like.shape if channels is None else like.shape[:2] + ((channels,) if channels > 1 else ())
+        image = self.images.get(name)
+        if image is None or image.shape != shape or image.dtype != like.dtype:
+            image = np.empty(shape, like.dtype)
+            self.images[name] = image
+        return image
+
+    def roi_mask(self, height, width):
+        mask = self.roi_masks.get((height, width))
+        if mask is None:
+            logging.debug('building region of interest mask for %dx%d' % (width, height))
+            mask = roi_mask(height, width)
+            self.roi_masks[(height, width)] = mask
+        return mask
+
+
+class LaneColorFilter(object):
+    """
+    Turns a BGR frame into a mask of the lane color. Build one per color
+    profile and keep it: the bounds are converted once, and with use_lut=True
+    a 256x256x256 BGR -> mask lookup table replaces cvtColor + inRange.
+    A filter keeps scratch images of the last frame size, so give each
+    follower its own. top=N only filters the rows from N down: the scratch
+    images stay at the full frame size and the band search uses views of them.
+    """
+
+    def __init__(self, color=_LANE_COLOR, use_lut=False):
+        if color not in _LANE_COLOR_PROFILES:
+            raise ValueError('Unknown lane color: %s' % color)
+        self.color = color
+        bounds = _LANE_COLOR_PROFILES[color]
+        if bounds is None:
+            self.lower = self.upper = None
+        else:
+            self.lower = np.array(bounds[0], np.uint8)
+            self.upper = np.array(bounds[1], np.uint8)
+        self.lut = None
+        if use_lut and bounds is not None:
+            self.lut = build_hsv_lut(self.lower, self.upper)
+        self.hsv = None
+        self.index = None
+        self.channel_index = None
+
+    def apply(self, frame, dst=None, top=0):
+        if self.lower is None:
+            # filter for white lane lines
+            return cv2.cvtColor(frame[top:], cv2.COLOR_BGR2GRAY, dst=dst)
+        if self.lut is not None:
+            return self.apply_lut(frame, dst, top)
+
+        if self.hsv is None or self.hsv.shape != frame.shape:
+            self.hsv = np.empty_like(frame)
+        hsv = cv2.cvtColor(frame[top:], cv2.COLOR_BGR2HSV, dst=self.hsv[top:])
+        show_image("hsv", hsv)
+        return cv2.inRange(hsv, self.lower, self.upper, dst=dst)
+
+    def apply_lut(self, frame, dst=None, top=0):
+        height, width, _ = frame.shape
+        if self.index is None or self.index.shape != (height, width):
+            self.index = np.empty((height, width), np.int32)
+            self.channel_index = np.empty((height, width), np.int32)
+        frame = frame[top:]
+        if dst is None:
+            dst = np.empty((height - top, width), np.uint8)
+
+        # index = b << 16 | g << 8 | r, built in place
+        index, channel_index = self.index[top:], self.channel_index[top:]
+        np.left_shift(frame[:, :, 0], 16, out=index, dtype=np.int32)
+        np.left_shift(frame[:, :, 1], 8, out=channel_index, dtype=np.int32)
+        np.bitwise_or(index, channel_index, out=index)
+        np.bitwise_or(index, frame[:, :, 2], out=index)
+        return np.take(self.lut, index, out=dst, mode='clip')
+
+
+def build_hsv_lut(lower, upper):
+    # cvtColor + inRange of every BGR color, one blue value (a 256x256 green x red plane) at a time
+    lut = np.empty(256 ** 3, np.uint8)
+    plane = np.empty((256, 256, 3), np.uint8)
+    plane[:, :, 1] = np.arange(256, dtype=np.uint8)[:, None]
+    plane[:, :, 2] = np.arange(256, dtype=np.uint8)[None, :]
+    hsv = np.empty_like(plane)
+    for blue in range(256):
+        plane[:, :, 0] = blue
+        cv2.cvtColor(plane, cv2.COLOR_BGR2HSV, dst=hsv)
+        lut[blue << 16:(blue + 1) << 16] = cv2.inRange(hsv, lower, upper).ravel()
+    return lut
+
+
+class LaneTracker(object):
+    """
+    Follows the lane lines from frame to frame instead of searching the whole
+    region of interest every time. Each line is tracked as the x of its two
+    end points (bottom of the frame and top of the region of interest, as in
+    make_points()) with an alpha-beta filter, which unlike slope and
+    intercept stays well behaved for near vertical lines.
+
+    A new line is only reported once it was seen min_hits frames in a row.
+    While both lines are locked, Hough only runs inside bands of band_width
+    pixels around the predicted lines. A line missing for more than
+    max_misses frames is dropped, and every redetect_interval frames the full
+    region is searched again, so a lost or drifting lock falls back to the
+    full search.
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1, band_width=40, min_hits=3, max_misses=3, redetect_interval=30):
+        self.alpha = alpha
+        self.beta = beta
+        self.band_width = band_width
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.redetect_interval = redetect_interval
+        self.lines = [None, None]  # left, right: x at the bottom and at the top
+        self.velocities = [None, None]
+        self.hits = [0, 0]
+        self.misses = [0, 0]
+        self.frames_since_search = 0
+
+    def is_confirmed(self, side):
+        return self.lines[side] is not None and self.hits[side] >= self.min_hits
+
+    def is_locked(self):
+        return (self.is_confirmed(0) and self.is_confirmed(1)
+                and self.frames_since_search < self.redetect_interval)
+
+    def band_mask(self, height, width, dst=None):
+        if dst is None:
+            dst = np.zeros((height, width), np.uint8)
+        else:
+            dst.fill(0)
+        y1, y2 = height, lane_line_top(height)
+        for line, velocity in zip(self.lines, self.velocities):
+            x1, x2 = (line + velocity).astype(int)
+            cv2.line(dst, (int(x1), y1), (int(x2), y2), 255, self.band_width)
+        return dst
+
+    def update(self, frame, left_fit, right_fit):
+        """
+        Feed the (slope, intercept) fits of this frame, None for a side not
+        found, and get the filtered lane lines back
+        """
+        searched_bands = self.is_locked()
+        for side, fit in enumerate((left_fit, right_fit)):
+            line = self.lines[side]
+            if fit is None:
+                if line is None:
+                    continue
+                self.misses[side] += 1
+                if self.misses[side] > self.max_misses or not self.is_confirmed(side):
+                    logging.debug('lane tracker: lost %s lane line' % ('left', 'right')[side])
+                    self.lines[side] = self.velocities[side] = None
+                    self.hits[side] = 0
+                else:
+                    # coast on the prediction
+                    self.lines[side] = line + self.velocities[side]
+                continue
+
+            x1, _, x2, _ = make_points(frame, fit)[0]
+            measured = np.array([x1, x2], np.float64)
+            self.misses[side] = 0
+            if line is None or np.abs(measured - line).max() > 2 * self.band_width:
+                # new line, or a jump no filter should smooth over
+                self.lines[side] = measured
+                self.velocities[side] = np.zeros(2)
+                self.hits[side] = 1
+                continue
+
+            self.hits[side] += 1
+
+            predicted = line + self.velocities[side]
+            residual = measured - predicted
+            self.lines[side] = predicted + self.alpha * residual
+            self.velocities[side] = self.velocities[side] + self.beta * residual
+
+        if searched_bands:
+            self.frames_since_search += 1
+        else:
+            self.frames_since_search = 0
+        return self.lane_lines(frame)
+
+    def lane_lines(self, frame):
+        height, _, _ = frame.shape
+        y1, y2 = height, lane_line_top(height)
+        return [[[int(line[0]), y1, int(line[1]), y2]]
+                for side, line in enumerate(self.lines) if self.is_confirmed(side)]
+
 
 ############################
 # Frame processing steps
 ############################
-def detect_lane(frame):
+def detect_lane(frame, buffers=None, render=True, color_filter=None, tracker=None):
+    """
+    Returns the lane lines and the frame with the lane lines drawn on it,
+    or with render=False the (cropped) frame as is
+    """
     logging.debug('detecting lane lines...')
-    
-    if _CROP_IMAGE: 
-        height, width, _ = frame.shape
-        x = 0 
-        y = int((height * 1 / 2) + _HEIGHT_OFFSET)
-        w = width
-        h = int((height * 1 / 2) + _HEIGHT_OFFSET)
-        frame = frame[y:y+h, x:x+w]
-    
-    edges = detect_edges(frame)
-    show_image('edges', edges)
 
-    cropped_edges = region_of_interest(edges)
+    frame = crop_frame(frame)
+
+    height, width, _ = frame.shape
+    edges = mask = None
+    if buffers is not None:
+        edges = buffers.get('edges', frame, channels=1)
+        mask = buffers.get('color mask', frame, channels=1)
+
+    if tracker is not None and tracker.is_locked():
+        # only search narrow bands around where the lane lines are expected,
+        # the color filter and Canny can skip the rows above the bands as well
+        top = max(0, lane_line_top(height) - tracker.band_width)
+        if edges is None:
+            edges = np.empty((height, width), np.uint8)
+        edges[:top].fill(0)
+        detect_edges(frame, edges=edges[top:], color_filter=color_filter,
+                     mask=None if mask is None else mask[top:], top=top)
+        if buffers is None:
+            cropped_edges = cv2.bitwise_and(edges, tracker.band_mask(height, width))
+        else:
+            cropped_edges = cv2.bitwise_and(edges, tracker.band_mask(height, width, buffers.get('band mask', edges)),
+                                            dst=buffers.get('edges cropped', edges))
+    else:
+        edges = detect_edges(frame, edges=edges, color_filter=color_filter, mask=mask)
+        if buffers is None:
+            cropped_edges = region_of_interest(edges)
+        else:
+            cropped_edges = region_of_interest(edges, mask=buffers.roi_mask(height, width),
+                                               dst=buffers.get('edges cropped', edges))
+    show_image('edges', edges)
     show_image('edges cropped', cropped_edges)
 
     line_segments = detect_line_segments(cropped_edges)
-    line_segment_image = display_lines(frame, line_segments)
+    if tracker is None:
+        lane_lines = average_slope_intercept_batched(frame, line_segments)
+    else:
+        lane_lines = tracker.update(frame, *fit_lane_sides(frame, line_segments))
+    if not render:
+        return lane_lines, frame
+
+    line_image = line_segment_image = lane_lines_image = None
+    if buffers is not None:
+        line_image = buffers.get('line image', frame)
+        line_segment_image = buffers.get('line segments', frame)
+        lane_lines_image = buffers.get('lane lines', frame)
+
+    line_segment_image = display_lines(frame, line_segments, line_image=line_image, dst=line_segment_image)
     show_image("line segments", line_segment_image)
 
-    lane_lines = average_slope_intercept(frame, line_segments)
-    lane_lines_image = display_lines(frame, lane_lines)
+    lane_lines_image = display_lines(frame, lane_lines, line_image=line_image, dst=lane_lines_image)
     show_image("lane lines", lane_lines_image)
 
     return lane_lines, lane_lines_image
 
 
-def detect_edges(frame):
-    if _LANE_COLOR == "white":
-        # filter for blue lane lines 
-        mask = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        show_image("White Mask", mask)
-    if _LANE_COLOR == "black":
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        #hsv = cv2.GaussianBlur(hsv, (5, 5), 0)
-        show_image("hsv", hsv)
-        lower_black = np.array([0, 0, 0],np.uint8)
-        upper_black = np.array([100, 100, 100],np.uint8)
-        mask = cv2.inRange(hsv, lower_black, upper_black)
-        show_image("black mask", mask)    
-    if _LANE_COLOR == "blue":
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        #hsv = cv2.GaussianBlur(hsv, (5, 5), 0)
-        show_image("hsv", hsv)
-        lower_blue = np.array([30, 40, 0])
-        upper_blue = np.array([150, 255, 255])
-        #lower_blue = np.array([110, 50, 50], np.uint8)
-        #upper_blue = np.array([130, 255, 255], np.uint8)
-        mask = cv2.inRange(hsv, lower_blue, upper_blue)
-        show_image("blue mask", mask)
-    if _LANE_COLOR == "yellow":
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        #hsv = cv2.GaussianBlur(hsv, (5, 5), 0)
-        show_image("hsv", hsv) 
-        hue_value = 25
-        yellow_lower = np.array([hue_value-10, 100, 100], np.uint8)
-        yellow_upper = np.array([hue_value+10, 255, 255], np.uint8)
-        mask = cv2.inRange(hsv, yellow_lower, yellow_upper)
-        show_image("yellow mask", mask)
-    if _LANE_COLOR == "red":
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        #hsv = cv2.GaussianBlur(hsv, (5, 5), 0)
-        show_image("hsv", hsv) 
-        hue_value = 180
-        red_lower = np.array([hue_value-10, 100, 100], np.uint8)
-        red_upper = np.array([hue_value+10, 255, 255], np.uint8)
-        mask = cv2.inRange(hsv, red_lower, red_upper)
-        show_image("red mask", mask)    
+def crop_frame(frame):
+    if not _CROP_IMAGE:
+        return frame
+
+    height, width, _ = frame.shape
+    x = 0
+    y = int((height * 1 / 2) + _HEIGHT_OFFSET)
+    w = width
+    h = int((height * 1 / 2) + _HEIGHT_OFFSET)
+    return frame[y:y+h, x:x+w]
+
+
+def detect_edges(frame, edges=None, color_filter=None, mask=None, top=0):
+    # edges and mask are the size of frame[top:]
+    if color_filter is None:
+        color_filter = LaneColorFilter(_LANE_COLOR)
+    mask = color_filter.apply(frame, dst=mask, top=top)
+    show_image("%s mask" % color_filter.color, mask)
+
     # detect edges
-    edges = cv2.Canny(mask, 200, 400)
+    edges = cv2.Canny(mask, 200, 400, edges=edges)
 
     return edges
 
@@ -150,12 +422,8 @@ def detect_edges_old(frame):
     return edges
 
 
-def region_of_interest(canny):
-    if _CROP_IMAGE:
-        return canny
-
-    height, width = canny.shape
-    mask = np.zeros_like(canny)
+def roi_mask(height, width):
+    mask = np.zeros((height, width), np.uint8)
 
     # only focus bottom half of the screen
 
@@ -167,8 +435,21 @@ def region_of_interest(canny):
     ]], np.int32)
 
     cv2.fillPoly(mask, polygon, 255)
+    return mask
+
+
+def region_of_interest(canny, mask=None, dst=None):
+    """
+    Pass a mask from roi_mask() and a dst image to reuse them across frames
+    """
+    if _CROP_IMAGE:
+        return canny
+
+    if mask is None:
+        height, width = canny.shape
+        mask = roi_mask(height, width)
     show_image("mask", mask)
-    masked_image = cv2.bitwise_and(canny, mask)
+    masked_image = cv2.bitwise_and(canny, mask, dst=dst)
     return masked_image
 
 
@@ -180,7 +461,7 @@ def detect_line_segments(cropped_edges):
     line_segments = cv2.HoughLinesP(cropped_edges, rho, angle, min_threshold, np.array([]), minLineLength=8,
                                     maxLineGap=4)
 
-    if line_segments is not None:
+    if line_segments is not None and logging.getLogger().isEnabledFor(logging.DEBUG):
         for line_segment in line_segments:
             logging.debug('detected line_segment:')
             logging.debug("%s of length %s" % (line_segment, length_of_line_segment(line_segment[0])))
@@ -235,6 +516,60 @@ def average_slope_intercept(frame, line_segments):
     return lane_lines
 
 
+def average_slope_intercept_batched(frame, line_segments):
+    """
+    Same as average_slope_intercept(), but fits the whole (N,1,4) array
+    from detect_line_segments() at once instead of one np.polyfit per segment
+    """
+    lane_lines = []
+    for fit in fit_lane_sides(frame, line_segments):
+        if fit is not None:
+            lane_lines.append(make_points(frame, fit))
+
+    logging.debug('lane lines: %s' % lane_lines)
+
+    return lane_lines
+
+
+def fit_lane_sides(frame, line_segments):
+    """
+    Average (slope, intercept) of the left and of the right lane line,
+    None for a side without line segments
+    """
+    if line_segments is None:
+        logging.info('No line_segment segments detected')
+        return None, None
+
+    height, width, _ = frame.shape
+    boundary = 1/3
+    left_region_boundary = width * (1 - boundary)  # left lane line segment should be on left 2/3 of the screen
+    right_region_boundary = width * boundary # right lane line segment should be on right 2/3 of the screen
+
+    segments = line_segments.reshape(-1, 4)
+    x1, y1, x2, y2 = segments.T
+    vertical = x1 == x2
+    if vertical.any():
+        logging.info('skipping %d vertical line segments (slope=inf)' % np.count_nonzero(vertical))
+        x1, y1, x2, y2 = segments[~vertical].T
+
+    # a line through two points, same result as np.polyfit((x1, x2), (y1, y2), 1).
+    # np.polyfit gives horizontal segments a tiny slope of random sign, so they
+    # land on either side by chance; they can't be a lane line, skip them instead
+    slopes = (y2 - y1) / (x2 - x1).astype(np.float64)
+    intercepts = y1 - slopes * x1
+
+    left = (slopes < 0) & (x1 < left_region_boundary) & (x2 < left_region_boundary)
+    right = (slopes > 0) & (x1 > right_region_boundary) & (x2 > right_region_boundary)
+
+    left_fit = right_fit = None
+    if left.any():
+        left_fit = (slopes[left].mean(), intercepts[left].mean())
+    if right.any():
+        right_fit = (slopes[right].mean(), intercepts[right].mean())
+
+    return left_fit, right_fit
+
+
 def compute_steering_angle(frame, lane_lines):
     """ Find the steering angle based on lane line coordinate
         We assume that camera is calibrated to point to dead center
@@ -292,18 +627,25 @@ def stabilize_steering_angle(curr_steering_angle, new_steering_angle, num_of_lan
 ############################
 # Utility Functions
 ############################
-def display_lines(frame, lines, line_color=(0, 255, 0), line_width=10):
-    line_image = np.zeros_like(frame)
+def display_lines(frame, lines, line_color=(0, 255, 0), line_width=10, line_image=None, dst=None):
+    # line_image is a scratch image and dst receives the result, pass both to reuse them across frames
+    if line_image is None:
+        line_image = np.zeros_like(frame)
+    else:
+        line_image.fill(0)
     if lines is not None:
         for line in lines:
             for x1, y1, x2, y2 in line:
                 cv2.line(line_image, (x1, y1), (x2, y2), line_color, line_width)
-    line_image = cv2.addWeighted(frame, 0.8, line_image, 1, 1)
+    line_image = cv2.addWeighted(frame, 0.8, line_image, 1, 1, dst=dst)
     return line_image
 
 
-def display_heading_line(frame, steering_angle, line_color=(0, 0, 255), line_width=5, ):
-    heading_image = np.zeros_like(frame)
+def display_heading_line(frame, steering_angle, line_color=(0, 0, 255), line_width=5, heading_image=None, dst=None):
+    if heading_image is None:
+        heading_image = np.zeros_like(frame)
+    else:
+        heading_image.fill(0)
     height, width, _ = frame.shape
 
     # figure out the heading line from steering angle
@@ -326,7 +668,7 @@ def display_heading_line(frame, steering_angle, line_color=(0, 0, 255), line_wid
         y2 = int(height / 2 + _HEIGHT_OFFSET)
     
     cv2.line(heading_image, (x1, y1), (x2, y2), line_color, line_width)
-    heading_image = cv2.addWeighted(frame, 0.8, heading_image, 1, 1)
+    heading_image = cv2.addWeighted(frame, 0.8, heading_image, 1, 1, dst=dst)
 
     return heading_image
 
@@ -341,16 +683,18 @@ def show_image(title, frame, show=_SHOW_IMAGE):
         cv2.imshow(title, frame)
 
 
+def lane_line_top(height):
+    if _CROP_IMAGE:
+        return 0
+    return int(height * 1 / 2 + _HEIGHT_OFFSET)  # make points from middle of the frame down
+
+
 def make_points(frame, line):
     height, width, _ = frame.shape
     slope, intercept = line
     y1 = height  # bottom of the frame
-    
-    if _CROP_IMAGE:
-        y2 = 0
-    else:
-        y2 = int(y1 * 1 / 2 + _HEIGHT_OFFSET)  # make points from middle of the frame down
-    
+    y2 = lane_line_top(height)
+
     # bound the coordinates within the frame
     x1 = max(-width, min(2 * width, int((y1 - intercept) / slope)))
     x2 = max(-width, min(2 * width, int((y2 - intercept) / slope)))
@@ -370,7 +714,9 @@ def test_photo(file):
 
 
 def test_video(video_file):
-    lane_follower = HandCodedLaneFollower()
+    # steering angles and timings go to video_file.tlm, frames to video_file.frames (see telemetry.py)
+    from telemetry import TelemetryLog, FrameContainer
+    lane_follower = HandCodedLaneFollower(control_only=True)
     cap = cv2.VideoCapture(video_file + '.avi')
 
     # skip first second of video.
@@ -379,29 +725,155 @@ def test_video(video_file):
 
     video_type = cv2.VideoWriter_fourcc(*'XVID')
     video_overlay = cv2.VideoWriter("%s_overlay.avi" % (video_file), video_type, 20.0, (320, 240))
+    telemetry = TelemetryLog(video_file + '.tlm')
+    frames = FrameContainer(video_file + '.frames')
     try:
         i = 0
         while cap.isOpened():
             ret, frame = cap.read()
             if ret:
                 print('frame %s' % i )
-                combo_image= lane_follower.follow_lane(frame)
-            
-                cv2.imwrite("%s_%03d_%03d.png" % (video_file, i, lane_follower.curr_steering_angle), frame)
-            
-                cv2.imwrite("%s_overlay_%03d.png" % (video_file, i), combo_image)
+                timestamp = time.monotonic()
+                lane_follower.follow_lane(frame)
+                start = time.perf_counter()
+                combo_image = lane_follower.render(frame)
+                lane_follower.stage_ms['render'] = (time.perf_counter() - start) * 1000
+
+                telemetry.append(timestamp, i, lane_follower.lane_lines, lane_follower.proposed_steering_angle,
+                                 lane_follower.curr_steering_angle, stage_ms=lane_follower.stage_ms)
+                frames.append(i, frame, timestamp)
                 video_overlay.write(combo_image)
                 cv2.imshow("Road with Lane line", combo_image)
 
                 i += 1
+            else:
+                break
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
     finally:
         cap.release()
         video_overlay.release()
+        telemetry.close()
+        frames.close()
         cv2.destroyAllWindows()
 
 
+def benchmark_average_slope_intercept(video_file, sizes=(10, 50, 100, 200, 400, 800), repeat=20):
+    """ Time the per-segment and batched fits on the Hough segments of a recorded video.
+        The recorded segments are tiled up to each size so the cost can be compared as N grows
+    """
+    cap = cv2.VideoCapture(video_file + '.avi')
+    recorded = []
+    max_diff = 0
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            line_segments = detect_line_segments(region_of_interest(detect_edges(frame)))
+            if line_segments is None:
+                continue
+            # compare without horizontal segments, which the loop version sorts by rounding noise
+            horizontal = line_segments[:, 0, 1] == line_segments[:, 0, 3]
+            lane_lines = average_slope_intercept(frame, line_segments[~horizontal])
+            lane_lines_batched = average_slope_intercept_batched(frame, line_segments)
+            if len(lane_lines) != len(lane_lines_batched):
+                max_diff = float('inf')
+            elif lane_lines:
+                max_diff = max(max_diff, np.abs(np.subtract(lane_lines, lane_lines_batched)).max())
+            recorded.append((frame, line_segments))
+    finally:
+        cap.release()
+    print('%d frames with line segments, max lane line difference %s px' % (len(recorded), max_diff))
+    if not recorded:
+        return
+
+    all_segments = np.concatenate([segments for _, segments in recorded])
+    frame = recorded[0][0]
+    print('%6s %12s %12s' % ('N', 'loop (ms)', 'batched (ms)'))
+    for size in sizes:
+        segments = np.resize(all_segments, (size, 1, 4))
+        timings = []
+        for fit in (average_slope_intercept, average_slope_intercept_batched):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fit(frame, segments)
+            timings.append((time.perf_counter() - start) / repeat * 1000)
+        print('%6d %12.3f %12.3f' % (size, timings[0], timings[1]))
+
+
+def benchmark_color_filter(video_file, sizes=((320, 240), (640, 480)), repeat=5):
+    """ Compare the cvtColor + inRange and lookup table paths of LaneColorFilter on a recorded video """
+    cap = cv2.VideoCapture(video_file + '.avi')
+    frames = []
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        return
+
+    start = time.perf_counter()
+    lut_filter = LaneColorFilter(_LANE_COLOR, use_lut=True)
+    print('built %s lookup table in %.0f ms' % (_LANE_COLOR, (time.perf_counter() - start) * 1000))
+    hsv_filter = LaneColorFilter(_LANE_COLOR)
+
+    print('%10s %12s %12s' % ('size', 'hsv (ms)', 'lut (ms)'))
+    for width, height in sizes:
+        resized = [cv2.resize(frame, (width, height)) for frame in frames]
+        mask = np.empty((height, width), np.uint8)
+        lut_mask = np.empty((height, width), np.uint8)
+        for frame in resized:
+            if not np.array_equal(hsv_filter.apply(frame, mask), lut_filter.apply(frame, lut_mask)):
+                logging.error('lookup table mask differs from cvtColor + inRange')
+                break
+        timings = []
+        for color_filter in (hsv_filter, lut_filter):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for frame in resized:
+                    color_filter.apply(frame, mask)
+            timings.append((time.perf_counter() - start) / repeat / len(resized) * 1000)
+        print('%10s %12.3f %12.3f' % ('%dx%d' % (width, height), timings[0], timings[1]))
+
+
+def benchmark_tracking(video_file):
+    """ Compare per-frame time and steering jitter with and without LaneTracker on a recorded video """
+    cap = cv2.VideoCapture(video_file + '.avi')
+    frames = []
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        return
+
+    print('%10s %10s %16s %14s' % ('mode', 'ms/frame', 'angle change', 'band search'))
+    for tracking in (False, True):
+        lane_follower = HandCodedLaneFollower(control_only=True, tracking=tracking)
+        angles = []
+        band_searches = 0
+        start = time.perf_counter()
+        for frame in frames:
+            if tracking and lane_follower.tracker.is_locked():
+                band_searches += 1
+            angle, _ = lane_follower.follow_lane(frame)
+            angles.append(angle)
+        elapsed = (time.perf_counter() - start) / len(frames) * 1000
+        # mean frame to frame change of the steering angle, lower is steadier
+        angle_change = np.abs(np.diff(angles)).mean()
+        print('%10s %10.3f %16.2f %13.0f%%' % ('tracking' if tracking else 'full', elapsed,
+                                            angle_change, 100.0 * band_searches / len(frames)))
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
@@ -409,3 +881,6 @@ if __name__ == '__main__':
     #test_photo('/home/pi/DeepPiCar/driver/data/video/car_video_190427_110320_073.png')
     #test_photo(sys.argv[1])
     #test_video(sys.argv[1])
+    #benchmark_average_slope_intercept('images/video01')
+    #benchmark_color_filter('images/video01')
+    #benchmark_tracking('images/video01')
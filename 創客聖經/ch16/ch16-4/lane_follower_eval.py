@@ -0,0 +1,111 @@
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from hand_coded_lane_follower import HandCodedLaneFollower
+from end_to_end_lane_follower import EndToEndLaneFollower, model_path
+
+# Headless regression test of the end-to-end model against the hand coded
+# lane follower: every recorded video of a directory is replayed in a pool
+# of worker processes, and the steering angles of both followers are
+# compared frame by frame.
+#   python3 lane_follower_eval.py <video_dir> [model_path] [batch_size]
+
+_BATCH_SIZE = 16
+_ERROR_BINS = np.arange(-30, 32, 2)  # angle error histogram, degrees
+_TOLERANCES = (2, 5, 10)             # accuracy = share of frames within this many degrees
+
+
+def evaluate_video(video_file, path=model_path, batch_size=_BATCH_SIZE):
+    """ Runs in a worker process, returns the angles of both followers and the time per stage """
+    logging.disable(logging.ERROR)  # the followers log every frame
+    hand_coded = HandCodedLaneFollower(control_only=True)
+    end_to_end = EndToEndLaneFollower(model_path=path, control_only=True,
+                                      num_threads=1, batch_size=batch_size)  # one process per core already
+    cap = cv2.VideoCapture(video_file)
+    stages = {'decode': 0.0, 'hand_coded': 0.0, 'end_to_end': 0.0}
+    desired, predicted, batch = [], [], []
+
+    def run_batch():
+        start = time.perf_counter()
+        predicted.extend(end_to_end.compute_steering_angles(batch))
+        stages['end_to_end'] += time.perf_counter() - start
+        del batch[:]
+
+    try:
+        while True:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            decoded = time.perf_counter()
+            stages['decode'] += decoded - start
+            if not ret:
+                break
+            angle, _ = hand_coded.follow_lane(frame)
+            desired.append(angle)
+            stages['hand_coded'] += time.perf_counter() - decoded
+            batch.append(frame)
+            if len(batch) == batch_size:
+                run_batch()
+        if batch:
+            run_batch()
+    finally:
+        cap.release()
+    return {'video': video_file, 'desired': np.array(desired), 'predicted': np.array(predicted), 'stages': stages}
+
+
+def evaluate(video_dir, path=model_path, batch_size=_BATCH_SIZE, processes=None):
+    """ Evaluates every .avi in video_dir in parallel, returns the per video results and the report text """
+    video_files = sorted(glob.glob(os.path.join(video_dir, '*.avi')))
+    if not video_files:
+        raise ValueError('No .avi videos in %s' % video_dir)
+    start = time.monotonic()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.starmap(evaluate_video, [(video_file, path, batch_size) for video_file in video_files])
+    finally:
+        pool.close()
+        pool.join()
+    return results, report(results, time.monotonic() - start)
+
+
+def report(results, elapsed):
+    lines = []
+    for result in results:
+        error = result['predicted'] - result['desired']
+        lines.append('%s: %d frames, mean abs error %.2f deg' % (
+            os.path.basename(result['video']), len(error), np.abs(error).mean() if len(error) else 0))
+
+    error = np.concatenate([result['predicted'] - result['desired'] for result in results])
+    frames = len(error)
+    lines.append('%d videos, %d frames in %.1f s (%.0f frames/s)' % (len(results), frames, elapsed, frames / elapsed))
+    if frames == 0:
+        return '\n'.join(lines)
+    lines.append('mean abs error %.2f deg, rmse %.2f deg, bias %+.2f deg' % (
+        np.abs(error).mean(), np.sqrt(np.mean(error ** 2.0)), error.mean()))
+    lines.append('accuracy: ' + ', '.join('within %d deg %.1f%%' % (tolerance, np.mean(np.abs(error) <= tolerance) * 100)
+                                          for tolerance in _TOLERANCES))
+
+    # errors beyond the outer bins are counted in them
+    counts, edges = np.histogram(np.clip(error, _ERROR_BINS[0], _ERROR_BINS[-1] - 1), _ERROR_BINS)
+    lines.append('angle error histogram (model - hand coded):')
+    for count, low in zip(counts, edges):
+        lines.append('%+4d..%+4d %6d %s' % (low, low + 2, count, '#' * int(round(60.0 * count / counts.max()))))
+
+    for stage in results[0]['stages']:
+        seconds = sum(result['stages'][stage] for result in results)
+        lines.append('%s: %.2f ms/frame, %.0f frames/s per process' % (
+            stage, seconds / frames * 1000, frames / seconds if seconds else 0))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    results, text = evaluate(sys.argv[1],
+                             sys.argv[2] if len(sys.argv) > 2 else model_path,
+                             int(sys.argv[3]) if len(sys.argv) > 3 else _BATCH_SIZE)
+    print(text)
@@ -2,9 +2,8 @@ import cv2
 import logging
 import datetime
 import time    
-from tflite_runtime.interpreter import Interpreter
-import numpy as np
 from traffic_objects import *
+from tflite_utils import load_interpreter, timings_text, InputTensor, get_detection_outputs, postprocess_detections, draw_detections
 
 _SHOW_IMAGE = False
 
@@ -20,7 +19,8 @@ class ObjectsOnRoadProcessor(object):
                  model='model_result/road_signs_quantized.tflite',
                  label='model_result/road_sign_labels.txt',
                  width=640,
-                 height=480):
+                 height=480,
+                 num_threads=None):
         # model: This MUST be a tflite model that was specifically compiled for Edge TPU.
         # https://coral.withgoogle.com/web-compiler/
         logging.info('Creating a ObjectsOnRoadProcessor...')
@@ -31,18 +31,21 @@ class ObjectsOnRoadProcessor(object):
         self.car = car
         self.speed_limit = speed_limit
         self.speed = speed_limit
+        self.car_speed = None  # last speed sent to the car
 
         # initialize TensorFlow models
         with open(label, 'r') as f:
             pairs = (l.strip().split(maxsplit=1) for l in f.readlines())
             self.labels = dict((int(k), v) for k, v in pairs)
 
-        self.interpreter = Interpreter(model_path=model)
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        self.interpreter, self.model_timings = load_interpreter(model, num_threads)
+        logging.info('Object detection model: %s' % timings_text(self.model_timings))
+        self.input = InputTensor(self.interpreter)
+        self.input_details = self.input.input_details
+        self.output_details = self.input.output_details
         self.min_confidence = 0.2
-        _, self.height, self.width, _ = self.interpreter.get_input_details()[0]["shape"]
+        self.height, self.width = self.input.height, self.input.width
+        self.frame_height = height  # height of the last processed camera frame, for is_close_by
 
         # initialize open cv for drawing boxes
         self.font = cv2.FONT_HERSHEY_SIMPLEX
@@ -56,46 +59,33 @@ class ObjectsOnRoadProcessor(object):
         self.annotate_text_time = time.time()
         self.time_to_show_prediction = 1.0  # ms
 
-        #
+        # stops are timed against frame timestamps, nothing here sleeps
         self.traffic_objects = {0: GreenTrafficLight(),
                                 1: Person(),
                                 2: RedTrafficLight(),
                                 3: SpeedLimit(25),
                                 4: SpeedLimit(40),
                                 5: StopSign()}
+        self.traffic_controller = TrafficController(self.traffic_objects, speed_limit)
 
-    def process_objects_on_road(self, frame):
+    def process_objects_on_road(self, frame, timestamp=None, draw=True):
         # Main entry point of the Road Object Handler
+        # timestamp: capture time of frame (time.monotonic()), defaults to now
+        # draw: False skips the boxes and FPS text, only the car is controlled
         logging.debug('Processing objects.................................')
         #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        objects, final_frame = self.detect_objects(frame)
-        self.control_car(objects)
+        objects, final_frame = self.detect_objects(frame, draw)
+        self.control_car(objects, timestamp)
         logging.debug('Processing objects END..............................')
 
         return final_frame
 
-    def control_car(self, objects):
+    def control_car(self, objects, timestamp=None):
         logging.debug('Control car...')
-        car_state = {"speed": self.speed_limit, "speed_limit": self.speed_limit}
-
-        if len(objects) == 0:
-            logging.debug('No objects detected, drive at speed limit of %s.' % self.speed_limit)
-
-        contain_stop_sign = False
-        for obj in objects:            
-            obj_label = self.labels[obj.label_id]
-            print(obj_label)
-            processor = self.traffic_objects[obj.label_id]
-            if processor.is_close_by(obj, self.height):
-                processor.set_car_state(car_state)
-            else:
-                logging.debug("[%s] object detected, but it is too far, ignoring. " % obj_label)
-            if obj_label == 'Stop':
-                contain_stop_sign = True
-
-        if not contain_stop_sign:
-            self.traffic_objects[5].clear()
+        for obj in objects:
+            logging.debug(self.labels[obj.label_id])
 
+        car_state = self.traffic_controller.update(objects, self.frame_height, timestamp)
         self.resume_driving(car_state)
 
     def resume_driving(self, car_state):
@@ -103,20 +93,16 @@ class ObjectsOnRoadProcessor(object):
         self.speed_limit = car_state['speed_limit']
         self.speed = car_state['speed']
 
-        if self.speed == 0:
-            self.set_speed(0)
-        else:
-            self.set_speed(self.speed_limit)
+        self.set_speed(self.speed)
         logging.debug('Current Speed = %d, New Speed = %d' % (old_speed, self.speed))
 
-        if self.speed == 0:
-            logging.debug('full stop for 1 seconds')
-            time.sleep(1)
-
     def set_speed(self, speed):
         # Use this setter, so we can test this class without a car attached
+        # The car is only told about changes: move() preempts the steering
+        # turn in progress, so it must not be sent on every detected frame
         self.speed = speed
-        if self.car is not None:
+        if self.car is not None and speed != self.car_speed:
+            self.car_speed = speed
             logging.debug("Actually setting car speed to %d" % speed)
             if speed == 0:
                 self.car.motor.stop()
@@ -126,56 +112,29 @@ class ObjectsOnRoadProcessor(object):
     ############################
     # Frame processing steps
     ############################
-    def detect_objects(self, frame):
+    def detect_objects(self, frame, draw=True):
         logging.debug('Detecting objects...')
         start_ms = time.time()
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame_resized = cv2.resize(frame_rgb, (self.width, self.height))
-        input_data = np.expand_dims(frame_resized, axis=0)
-        self.interpreter.set_tensor(self.input_details[0]["index"],input_data)
+        self.input.set_image(frame)
         self.interpreter.invoke()
-        boxes = self.interpreter.get_tensor(self.output_details[0]["index"])[0]
-        classes = self.interpreter.get_tensor(self.output_details[1]["index"])[0]
-        scores = self.interpreter.get_tensor(self.output_details[2]["index"])[0] 
-        objects = []
-        imHeight = frame.shape[0]
-        imWidth = frame.shape[1]
-        for i in range(len(scores)):
-            if ((scores[i] > self.min_confidence) and (scores[i] <= 1.0)):
-                min_y = int(max(1,(boxes[i][0] * imHeight)))
-                min_x = int(max(1,(boxes[i][1] * imWidth)))
-                max_y = int(min(imHeight,(boxes[i][2] * imHeight)))
-                max_x = int(min(imWidth,(boxes[i][3] * imWidth)))              
-                cv2.rectangle(frame, (min_x,min_y), (max_x,max_y), (10,255,0), 2)  
-                object_name = self.labels[int(classes[i])]
-                objects.append(detect_objs(int(classes[i]), boxes))
-                label = "%s: %d%%" % (object_name, int(scores[i]*100))
-                labelSize, baseLine = cv2.getTextSize(label,
-                                      cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-                label_min_y = max(min_x, labelSize[1] + 10)
-                cv2.rectangle(frame, (min_x, label_min_y-labelSize[1]-10),
-                                 (min_x+labelSize[0], label_min_y+baseLine-10), 
-                                 (255, 255, 255), cv2.FILLED) 
-                cv2.putText(frame, label, (min_x, label_min_y-7), 
-                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+        boxes, classes, scores = get_detection_outputs(self.interpreter, self.output_details)
+        self.frame_height, imWidth = frame.shape[:2]
+        objects = postprocess_detections(boxes, classes, scores, self.frame_height, imWidth, self.min_confidence)
 
         if len(objects) == 0:
             logging.debug('No object detected')
 
         elapsed_ms = time.time() - start_ms
 
-        annotate_summary = "%.1f FPS" % (1.0/elapsed_ms)
-        logging.debug(annotate_summary)
-        cv2.putText(frame, annotate_summary, self.bottomLeftCornerOfText, self.font, self.fontScale, self.fontColor, self.lineType)
+        if draw:
+            draw_detections(frame, objects, self.labels)
+            annotate_summary = "%.1f FPS" % (1.0/elapsed_ms)
+            logging.debug(annotate_summary)
+            cv2.putText(frame, annotate_summary, self.bottomLeftCornerOfText, self.font, self.fontScale, self.fontColor, self.lineType)
         #cv2.imshow('Detected Objects', frame)
 
         return objects, frame
 
-class detect_objs:
-    # 建構式
-    def __init__(self, label_id, bounding_box):
-        self.label_id = label_id 
-        self.bounding_box = bounding_box
 ############################
 # Utility Functions
 ############################
@@ -197,22 +156,19 @@ def test_photo(file):
     cv2.destroyAllWindows()
 
 def test_stop_sign():
-    # this simulates a car at stop sign
+    # this simulates a car at stop sign, the frame timestamps stand in for the passing time
     object_processor = ObjectsOnRoadProcessor()
     frame = cv2.imread('images/stop_sign.jpg')
-    combo_image = object_processor.process_objects_on_road(frame)
+    combo_image = object_processor.process_objects_on_road(frame, timestamp=0)
     show_image('Stop 1', combo_image)
-    time.sleep(1)
     frame = cv2.imread('images/stop_sign.jpg')
-    combo_image = object_processor.process_objects_on_road(frame)
+    combo_image = object_processor.process_objects_on_road(frame, timestamp=1)
     show_image('Stop 2', combo_image)
-    time.sleep(2)
     frame = cv2.imread('images/stop_sign.jpg')
-    combo_image = object_processor.process_objects_on_road(frame)
+    combo_image = object_processor.process_objects_on_road(frame, timestamp=3)
     show_image('Stop 3', combo_image)
-    time.sleep(1)
     frame = cv2.imread('images/green_light.jpg')
-    combo_image = object_processor.process_objects_on_road(frame)
+    combo_image = object_processor.process_objects_on_road(frame, timestamp=4)
     show_image('Stop 4', combo_image)
 
     cv2.waitKey(0)
@@ -1,21 +1,47 @@
 from gpiozero import Motor
 from time import sleep
+import threading
 
 class MotorControl():
-    def __init__(self, in1=18, in2=23, in3=24, in4=25):
+    """
+    turn_angle() does not block: the timed left/right differential is applied
+    by a background actuator thread, and a newer turn_angle(), move() or
+    stop() preempts the turn still in progress. After stop() turns are
+    ignored until move() sets a speed again, so steering and speed can come
+    from different threads without a turn restarting a stopped car
+    """
+    def __init__(self, in1=18, in2=23, in3=24, in4=25, turn_time=0.2):
         self.motor1 = Motor(forward=in1, backward=in2, pwm=True)
         self.motor2 = Motor(forward=in3, backward=in4, pwm=True)
-        
+
         self.left_speed = 0.26
         self.right_speed = 0.29
         self.MINI_SPEED = 0.25
         self.current_speed = 0.40
-        
+        self.turn_time = turn_time
+
+        # the caller and the actuator thread both drive the motors
+        self.condition = threading.Condition()
+        self.pending = None   # latest (angle, speed) not picked up by the actuator yet
+        self.command_id = 0   # bumped by every command, so a turn in progress can tell it was preempted
+        self.running = True
+        self.actuator = threading.Thread(target=self._actuate, name='actuator', daemon=True)
+        self.actuator.start()
+
     def stop(self, delay=0):
-        self.motor1.stop()
-        self.motor2.stop()
+        with self.condition:
+            self._preempt()
+            self.current_speed = 0
+            self.motor1.stop()
+            self.motor2.stop()
         sleep(delay)
-    
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.actuator.join()
+
     def forward(self, left_speed=1.0, right_speed=1.0):
         self.motor1.forward(left_speed)
         self.motor2.forward(right_speed)
@@ -23,11 +49,17 @@ class MotorControl():
     def backward(self, left_speed=1.0, right_speed=1.0):
         self.motor1.backward(left_speed)
         self.motor2.backward(right_speed)
-        
+
     def move(self, speed=0.40, left_inc=0, right_inc=0, dir=True, delay=0):
+        with self.condition:
+            self._preempt()
+            self._move(speed, left_inc, right_inc, dir)
+        sleep(delay)
+
+    def _move(self, speed=0.40, left_inc=0, right_inc=0, dir=True):
         self.current_speed = speed
         lspeed = self.left_speed + (speed - self.MINI_SPEED) + left_inc
-        rspeed = self.right_speed + (speed - self.MINI_SPEED) + right_inc        
+        rspeed = self.right_speed + (speed - self.MINI_SPEED) + right_inc
         if lspeed < 0: lspeed = 0
         if lspeed > 1: lspeed = 1
         if rspeed < 0: rspeed = 0
@@ -37,27 +69,57 @@ class MotorControl():
             self.forward(lspeed, rspeed)
         else:     # backward
             self.backward(lspeed, rspeed)
-        sleep(delay)
 
-    def turn_angle(self, angle=90):
+    def _preempt(self):
+        # called with self.condition held
+        self.command_id += 1
+        self.pending = None
+        self.condition.notify_all()
+
+    def turn_angle(self, angle=90, speed=None):
+        # returns at once, the actuator thread applies the turn
+        with self.condition:
+            self._preempt()
+            self.pending = (angle, self.current_speed if speed is None else speed)
+
+    def _turn(self, angle, speed):
         weights = 5
         if angle > 90:
             # turn right
             inc = (angle - 90)
             inc = inc // 2 + weights
-            self.move(self.current_speed, left_inc=inc/100.0, right_inc=-(inc/100.0))  
+            self._move(speed, left_inc=inc/100.0, right_inc=-(inc/100.0))
         if angle < 90:
             # turn left
             inc = (90 - angle)
             inc = inc // 2 + weights
-            self.move(self.current_speed, right_inc=inc/100.0, left_inc=-(inc/100.0))
-        sleep(0.2)
-        self.move(self.current_speed)
- 
+            self._move(speed, right_inc=inc/100.0, left_inc=-(inc/100.0))
+
+    def _actuate(self):
+        with self.condition:
+            while self.running:
+                if self.pending is None:
+                    self.condition.wait()
+                    continue
+                angle, speed = self.pending
+                self.pending = None
+                if speed == 0:
+                    # stopped, keep the motors off
+                    continue
+                command_id = self.command_id
+                self._turn(angle, speed)
+                # hold the turn for turn_time, unless a newer command comes in
+                preempted = self.condition.wait_for(
+                    lambda: self.command_id != command_id or not self.running, self.turn_time)
+                if not preempted:
+                    self._move(speed)
+
 if __name__ == '__main__':
     m = MotorControl()
     #m.move(0.40)
     #sleep(2)
     #m.turn_angle(135)
     m.turn_angle(45)
+    sleep(0.5)
     m.stop()
+    m.close()
@@ -1,23 +1,35 @@
 import cv2
 import sys
+import time
 from hand_coded_lane_follower import HandCodedLaneFollower
+from telemetry import TelemetryLog, FrameContainer
 
 
 def save_image_and_steering_angle(video_file):
-    lane_follower = HandCodedLaneFollower()
+    # frame i is entry i of video_file.frames, its steering angle is record i of video_file.tlm
+    lane_follower = HandCodedLaneFollower(control_only=True)
     cap = cv2.VideoCapture(video_file + '.avi')
+    telemetry = TelemetryLog(video_file + '.tlm')
+    frames = FrameContainer(video_file + '.frames')
 
     try:
         i = 0
         while cap.isOpened():
-            _, frame = cap.read()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timestamp = time.monotonic()
             lane_follower.follow_lane(frame)
-            cv2.imwrite("%s_%03d_%03d.png" % (video_file, i, lane_follower.curr_steering_angle), frame)
+            telemetry.append(timestamp, i, lane_follower.lane_lines, lane_follower.proposed_steering_angle,
+                             lane_follower.curr_steering_angle, stage_ms=lane_follower.stage_ms)
+            frames.append(i, frame, timestamp)
             i += 1
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
     finally:
         cap.release()
+        telemetry.close()
+        frames.close()
         cv2.destroyAllWindows()
 
 
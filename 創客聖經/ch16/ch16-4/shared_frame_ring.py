@@ -0,0 +1,263 @@
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+# header fields, int64 each
+_LATEST_SEQ = 0  # sequence number of the newest committed frame
+_CLOSED = 1      # 1 once the writer is done
+
+
+class SharedFrameRing(object):
+    """
+    A fixed ring of frame slots in multiprocessing.shared_memory. The capture
+    code writes each frame once, straight into a slot (begin_write/commit),
+    and readers in other processes get numpy views of the same memory, so
+    frames are neither copied per consumer nor pickled between processes.
+
+    Every slot carries the sequence number of the frame in it. The writer
+    never waits for readers: a slow reader just skips to the newest frame,
+    and valid(seq) tells it whether the slot it was working on has been
+    overwritten since. Each reader also publishes its cursor (the last
+    sequence number it read), so the writer side can see how far behind
+    every reader is.
+
+    The ring can be passed to multiprocessing.Process as an argument, the
+    child attaches to the same shared memory by name.
+    """
+
+    def __init__(self, shape=(480, 640, 3), dtype=np.uint8, slots=4, max_readers=4):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.max_readers = max_readers
+        self.condition = multiprocessing.Condition()
+        self.owner_pid = os.getpid()
+        self.shm = shared_memory.SharedMemory(create=True, size=self._size())
+        self._map()
+        self.header[:] = 0
+        self.slot_seq[:] = 0
+        self.slot_time[:] = 0
+        self.cursors[:] = -1  # -1: reader id not used
+
+    def _size(self):
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        return 8 * (2 + 2 * self.slots + self.max_readers) + frame_bytes * self.slots
+
+    def _map(self):
+        buf = self.shm.buf
+        offset = 0
+        self.header = np.ndarray((2,), np.int64, buf, offset)
+        offset += self.header.nbytes
+        self.slot_seq = np.ndarray((self.slots,), np.int64, buf, offset)  # -1 while being written
+        offset += self.slot_seq.nbytes
+        self.slot_time = np.ndarray((self.slots,), np.float64, buf, offset)
+        offset += self.slot_time.nbytes
+        self.cursors = np.ndarray((self.max_readers,), np.int64, buf, offset)
+        offset += self.cursors.nbytes
+        self.frames = np.ndarray((self.slots,) + self.shape, self.dtype, buf, offset)
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'shape': self.shape, 'dtype': self.dtype.str,
+                'slots': self.slots, 'max_readers': self.max_readers, 'condition': self.condition}
+
+    def __setstate__(self, state):
+        # attach to the ring created by another process
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.slots = state['slots']
+        self.max_readers = state['max_readers']
+        self.condition = state['condition']
+        self.owner_pid = None
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self._map()
+
+    ############################
+    # Writer side
+    ############################
+    def begin_write(self):
+        """ Returns (seq, view) of the next slot, fill the view then commit(seq), or abort(seq) if that fails """
+        with self.condition:
+            seq = int(self.header[_LATEST_SEQ]) + 1
+            slot = seq % self.slots
+            self.slot_seq[slot] = -1
+        return seq, self.frames[slot]
+
+    def commit(self, seq, timestamp=None):
+        slot = seq % self.slots
+        with self.condition:
+            self.slot_time[slot] = time.monotonic() if timestamp is None else timestamp
+            self.slot_seq[slot] = seq
+            self.header[_LATEST_SEQ] = seq
+            self.condition.notify_all()
+
+    def abort(self, seq):
+        # the slot was not filled: leave it empty (its old frame may be half overwritten),
+        # the next begin_write() hands out the same seq again
+        with self.condition:
+            self.slot_seq[seq % self.slots] = 0
+
+    def write(self, frame, timestamp=None):
+        # for frames that are already in memory somewhere else, copies frame into the ring once
+        seq, view = self.begin_write()
+        np.copyto(view, frame)
+        self.commit(seq, timestamp)
+        return seq
+
+    def close_writer(self):
+        # wakes up all readers, their read() returns no frame from now on
+        with self.condition:
+            self.header[_CLOSED] = 1
+            self.condition.notify_all()
+
+    def lag(self):
+        # frames each reader is behind the writer, None for reader ids nobody uses
+        with self.condition:
+            latest = int(self.header[_LATEST_SEQ])
+            return [latest - int(cursor) if cursor >= 0 else None for cursor in self.cursors]
+
+    ############################
+    # Reader side
+    ############################
+    def reader(self, reader_id):
+        # reader_id: 0 .. max_readers-1, one per consumer
+        return FrameRingReader(self, reader_id)
+
+    def valid(self, seq):
+        """ True while the slot of frame seq still holds that frame """
+        with self.condition:
+            return self.slot_seq[seq % self.slots] == seq
+
+    def close(self):
+        # every process closes its own mapping, the creating process also frees the memory
+        # (a forked child gets the ring without pickling, hence the pid check)
+        self.header = self.slot_seq = self.slot_time = self.cursors = self.frames = None
+        self.shm.close()
+        if self.owner_pid == os.getpid():
+            self.shm.unlink()
+
+
+class FrameRingReader(object):
+    """
+    One consumer of a SharedFrameRing. read() has the same interface as
+    LatestFrameGrabber.read, so a FrameWorker can run on a ring reader in
+    another process
+    """
+
+    def __init__(self, ring, reader_id):
+        self.ring = ring
+        self.reader_id = reader_id
+        self.overruns = 0  # frames that were overwritten while this reader still used them
+        with ring.condition:
+            ring.cursors[reader_id] = 0
+
+    @property
+    def running(self):
+        return not self.ring.header[_CLOSED]
+
+    def read(self, last_seq=0, timeout=None):
+        """
+        Wait for a frame newer than last_seq, returns (seq, capture timestamp, frame).
+        frame is a view into shared memory, valid until the writer laps the
+        ring; it is None once the writer closed or on timeout
+        """
+        ring = self.ring
+        with ring.condition:
+            if not ring.condition.wait_for(
+                    lambda: ring.header[_LATEST_SEQ] > last_seq or ring.header[_CLOSED], timeout):
+                return last_seq, None, None
+            seq = int(ring.header[_LATEST_SEQ])
+            if seq <= last_seq:
+                return last_seq, None, None
+            slot = seq % ring.slots
+            ring.cursors[self.reader_id] = seq
+            return seq, float(ring.slot_time[slot]), ring.frames[slot]
+
+    def done(self, seq):
+        # call after using frame seq, returns False (and counts an overrun) if it was overwritten meanwhile
+        if self.ring.valid(seq):
+            return True
+        self.overruns += 1
+        return False
+
+
+############################
+# Test Functions
+############################
+def follow_lane_process(ring, reader_id, angles):
+    # a lane follower in its own process, steering angles go back through a queue
+    from hand_coded_lane_follower import HandCodedLaneFollower
+    reader = ring.reader(reader_id)
+    lane_follower = HandCodedLaneFollower(control_only=True)
+    seq = 0
+    while True:
+        seq, _, frame = reader.read(seq)
+        if frame is None:
+            break
+        angle, _ = lane_follower.follow_lane(frame)
+        if reader.done(seq):
+            angles.put((seq, angle))
+    angles.put((None, reader.overruns))
+    ring.close()
+
+
+def record_process(ring, reader_id, video_file):
+    import cv2
+    reader = ring.reader(reader_id)
+    video = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'XVID'), 20.0, (ring.shape[1], ring.shape[0]))
+    seq = 0
+    while True:
+        seq, _, frame = reader.read(seq)
+        if frame is None:
+            break
+        video.write(frame)
+        reader.done(seq)
+    video.release()
+    ring.close()
+
+
+def test_video(video_file):
+    import cv2
+    cap = cv2.VideoCapture(video_file + '.avi')
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    ring = SharedFrameRing((height, width, 3), slots=8)
+    angles = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=follow_lane_process, args=(ring, 0, angles)),
+               multiprocessing.Process(target=record_process, args=(ring, 1, '%s_ring.avi' % video_file))]
+    for process in readers:
+        process.start()
+
+    frames = 0
+    while True:
+        # decode straight into the shared slot
+        seq, view = ring.begin_write()
+        ret, _ = cap.read(view)
+        if not ret:
+            ring.abort(seq)
+            break
+        ring.commit(seq)
+        frames += 1
+        time.sleep(0.05)  # 20 fps camera
+    cap.release()
+    logging.info('reader lag at the end: %s' % ring.lag())
+    ring.close_writer()
+
+    steered = 0
+    while True:
+        seq, value = angles.get()
+        if seq is None:
+            logging.info('%d frames written, %d steered, %d overruns' % (frames, steered, value))
+            break
+        steered += 1
+    for process in readers:
+        process.join()
+    ring.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_video("images/video01")
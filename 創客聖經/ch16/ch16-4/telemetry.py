@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import struct
+import cv2
+import numpy as np
+
+# Per frame driving records in one append-only binary file, and the frames
+# themselves in one indexed container file, instead of two PNGs per frame
+# with the steering angle in their file names
+
+_STAGES = ('detect_lane', 'steer', 'render')  # per-stage timings, in ms
+_TELEMETRY_MAGIC = b'TLM1'
+_HEADER_LENGTH = struct.Struct('<4sI')  # magic, length of the json dtype description
+
+
+def telemetry_dtype(stages=_STAGES):
+    return np.dtype([('timestamp', '<f8'),        # time.monotonic() of the frame
+                     ('frame', '<u4'),            # frame index
+                     ('lane_count', 'u1'),        # how many of lane_lines are valid
+                     ('lane_lines', '<i2', (2, 4)),  # x1, y1, x2, y2 of up to two lane lines
+                     ('proposed_angle', '<i2'),   # angle computed from this frame
+                     ('steering_angle', '<i2'),   # stabilized angle sent to the car
+                     ('speed', '<i2'),
+                     ('stage_ms', '<f4', (len(stages),))])
+
+
+class TelemetryLog(object):
+    """
+    Appends one fixed-size record per frame to a binary file. The file starts
+    with a header holding the record dtype (and stage names), so
+    read_telemetry() returns the whole log as a memory-mapped NumPy
+    structured array, e.g. log['steering_angle'] or log['stage_ms'][:, 0]
+    """
+
+    def __init__(self, path, stages=_STAGES):
+        self.path = path
+        self.stages = tuple(stages)
+        self.dtype = telemetry_dtype(self.stages)
+        self.record = np.zeros(1, self.dtype)
+        description = json.dumps({'descr': self.dtype.descr, 'stages': self.stages}).encode('utf-8')
+        self.file = open(path, 'wb')
+        self.file.write(_HEADER_LENGTH.pack(_TELEMETRY_MAGIC, len(description)))
+        self.file.write(description)
+
+    def append(self, timestamp, frame, lane_lines, proposed_angle, steering_angle, speed=0, stage_ms=None):
+        """ lane_lines as returned by detect_lane, stage_ms maps stage name to milliseconds """
+        record = self.record[0]
+        record['timestamp'] = timestamp
+        record['frame'] = frame
+        record['lane_count'] = min(len(lane_lines), 2)
+        record['lane_lines'] = 0
+        for i, line in enumerate(lane_lines[:2]):
+            record['lane_lines'][i] = line[0]
+        record['proposed_angle'] = proposed_angle
+        record['steering_angle'] = steering_angle
+        record['speed'] = speed
+        record['stage_ms'] = [stage_ms.get(stage, 0) if stage_ms else 0 for stage in self.stages]
+        self.file.write(self.record.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_telemetry(path):
+    """ Returns (records, stage names), records is a read-only memory-mapped structured array """
+    with open(path, 'rb') as f:
+        magic, length = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+        if magic != _TELEMETRY_MAGIC:
+            raise ValueError('%s is not a telemetry log' % path)
+        description = json.loads(f.read(length).decode('utf-8'))
+    dtype = np.dtype([tuple(field) for field in description['descr']])
+    offset = _HEADER_LENGTH.size + length
+    count = (os.path.getsize(path) - offset) // dtype.itemsize  # ignore a half written last record
+    if count == 0:
+        return np.zeros(0, dtype), description['stages']
+    return np.memmap(path, dtype, 'r', offset, (count,)), description['stages']
+
+
+_INDEX_DTYPE = np.dtype([('frame', '<u4'), ('timestamp', '<f8'), ('offset', '<u8'), ('length', '<u4')])
+
+
+class FrameContainer(object):
+    """
+    Stores encoded frames back to back in one file (path), with a fixed-size
+    index record per frame in path + '.idx', both append-only. The index can
+    be memory-mapped (read_frame_index), and read_frame() seeks straight to
+    one frame. ext picks the codec: '.png' is lossless, '.jpg' is about ten
+    times faster to encode and smaller, but lossy
+    """
+
+    def __init__(self, path, ext='.png', params=()):
+        self.path = path
+        self.ext = ext
+        self.params = list(params)
+        self.data = open(path, 'wb')
+        self.index = open(path + '.idx', 'wb')
+        self.entry = np.zeros(1, _INDEX_DTYPE)
+        self.offset = 0
+
+    def append(self, frame_index, frame, timestamp=0):
+        ret, encoded = cv2.imencode(self.ext, frame, self.params)
+        if not ret:
+            logging.error('Could not encode frame %d' % frame_index)
+            return
+        self.data.write(encoded)
+        self.entry[0] = (frame_index, timestamp, self.offset, len(encoded))
+        self.index.write(self.entry.tobytes())
+        self.offset += len(encoded)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+def read_frame_index(path):
+    size = os.path.getsize(path + '.idx') // _INDEX_DTYPE.itemsize
+    if size == 0:
+        return np.zeros(0, _INDEX_DTYPE)
+    return np.memmap(path + '.idx', _INDEX_DTYPE, 'r', 0, (size,))
+
+
+def read_frame(path, entry, flags=cv2.IMREAD_COLOR):
+    # entry: one record of read_frame_index(path)
+    with open(path, 'rb') as f:
+        f.seek(int(entry['offset']))
+        encoded = np.frombuffer(f.read(int(entry['length'])), np.uint8)
+    return cv2.imdecode(encoded, flags)
+
+
+############################
+# Test Functions
+############################
+def test_log(video_file):
+    records, stages = read_telemetry(video_file + '.tlm')
+    logging.info('%d records, stages %s' % (len(records), stages))
+    if len(records):
+        logging.info('mean steering angle %.1f, %d frames with both lane lines' % (
+            records['steering_angle'].mean(), (records['lane_count'] == 2).sum()))
+        for stage, column in zip(stages, records['stage_ms'].T):
+            logging.info('%s: mean %.2f ms, max %.2f ms' % (stage, column.mean(), column.max()))
+    index = read_frame_index(video_file + '.frames')
+    if len(index):
+        frame = read_frame(video_file + '.frames', index[len(index) // 2])
+        logging.info('%d frames stored, middle one is %s' % (len(index), frame.shape))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_log("images/video01")
@@ -1,10 +1,15 @@
-from threading import Timer
 import logging
+import time
 
 
 class TrafficObject(object):
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
+        # called on every frame this object is detected close by, now is the frame timestamp
+        pass
+
+    def clear(self, car_state, now):
+        # called on every frame this object is not detected at all
         pass
 
     @staticmethod
@@ -16,20 +21,20 @@ class TrafficObject(object):
 
 class RedTrafficLight(TrafficObject):
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
         logging.debug('red light: stopping car')
         car_state['speed'] = 0
 
 
 class GreenTrafficLight(TrafficObject):
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
         logging.debug('green light: make no changes')
 
 
 class Person(TrafficObject):
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
         logging.debug('pedestrian: stopping car')
 
         car_state['speed'] = 0
@@ -40,14 +45,15 @@ class SpeedLimit(TrafficObject):
     def __init__(self, speed_limit):
         self.speed_limit = speed_limit
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
         logging.debug('speed limit: set limit to %d' % self.speed_limit)
         car_state['speed_limit'] = self.speed_limit
 
 
 class StopSign(TrafficObject):
     """
-    Stop Sign object would wait
+    Stop Sign object would wait. The wait is a deadline checked against the
+    timestamps of later frames, the car keeps seeing frames while it waits
     """
 
     def __init__(self, wait_time_in_sec=3, min_no_stop_sign=20):
@@ -56,15 +62,12 @@ class StopSign(TrafficObject):
         self.wait_time_in_sec = wait_time_in_sec
         self.min_no_stop_sign = min_no_stop_sign
         self.no_stop_count = min_no_stop_sign
-        self.timer = None
+        self.wait_until = 0
 
-    def set_car_state(self, car_state):
+    def set_car_state(self, car_state, now):
         self.no_stop_count = self.min_no_stop_sign
-
+        self.hold(car_state, now)
         if self.in_wait_mode:
-            logging.debug('stop sign: 2) still waiting')
-            # wait for 2 second before proceeding
-            car_state['speed'] = 0
             return
 
         if not self.has_stopped:
@@ -73,15 +76,22 @@ class StopSign(TrafficObject):
             car_state['speed'] = 0
             self.in_wait_mode = True
             self.has_stopped = True
-            self.timer = Timer(self.wait_time_in_sec, self.wait_done)
-            self.timer.start()
+            self.wait_until = now + self.wait_time_in_sec
             return
 
-    def wait_done(self):
-        logging.debug('stop sign: 3) finished waiting for %d seconds' % self.wait_time_in_sec)
-        self.in_wait_mode = False
+    def hold(self, car_state, now):
+        if not self.in_wait_mode:
+            return
+        if now < self.wait_until:
+            logging.debug('stop sign: 2) still waiting')
+            car_state['speed'] = 0
+        else:
+            logging.debug('stop sign: 3) finished waiting for %d seconds' % self.wait_time_in_sec)
+            self.in_wait_mode = False
 
-    def clear(self):
+    def clear(self, car_state, now):
+        # keep waiting even if a frame misses the stop sign
+        self.hold(car_state, now)
         if self.has_stopped:
             # need this counter in case object detection has a glitch that one frame does not
             # detect stop sign, make sure we see 20 consecutive no stop sign frames (about 1 sec)
@@ -91,3 +101,147 @@ class StopSign(TrafficObject):
                 logging.debug("stop sign: 4) no more stop sign detected")
                 self.has_stopped = False
                 self.in_wait_mode = False  # may not need to set this
+
+
+class TrafficController(object):
+    """
+    Turns the objects detected in each frame into the speed to drive at.
+    It is driven by frame timestamps only: nothing here sleeps or starts a
+    thread, a stop is a deadline that later frames are checked against.
+    The car stays stopped for full_stop_time seconds after the last frame
+    that gave it a reason to stop.
+    """
+
+    def __init__(self, traffic_objects, speed_limit=40, full_stop_time=1.0, clock=time.monotonic):
+        self.traffic_objects = traffic_objects
+        self.speed_limit = speed_limit
+        self.speed = speed_limit
+        self.full_stop_time = full_stop_time
+        self.clock = clock
+        self.stopped_until = 0
+
+    def update(self, objects, frame_height, now=None):
+        """ Returns the new car state {"speed", "speed_limit"} for this frame """
+        if now is None:
+            now = self.clock()
+        car_state = {"speed": self.speed_limit, "speed_limit": self.speed_limit}
+
+        if len(objects) == 0:
+            logging.debug('No objects detected, drive at speed limit of %s.' % self.speed_limit)
+
+        seen = set()
+        for obj in objects:
+            seen.add(obj.label_id)
+            processor = self.traffic_objects[obj.label_id]
+            if processor.is_close_by(obj, frame_height):
+                processor.set_car_state(car_state, now)
+            else:
+                logging.debug("[%s] object detected, but it is too far, ignoring. " % obj.label_id)
+
+        for label_id, processor in self.traffic_objects.items():
+            if label_id not in seen:
+                processor.clear(car_state, now)
+
+        if car_state['speed'] == 0:
+            logging.debug('full stop for %s seconds' % self.full_stop_time)
+            self.stopped_until = now + self.full_stop_time
+        elif now < self.stopped_until:
+            car_state['speed'] = 0
+        else:
+            car_state['speed'] = car_state['speed_limit']
+
+        self.speed_limit = car_state['speed_limit']
+        self.speed = car_state['speed']
+        return car_state
+
+
+############################
+# Test Functions
+############################
+class FakeClock(object):
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeObject(object):
+
+    def __init__(self, label_id, height=100):
+        self.label_id = label_id
+        self.bounding_box = ((0, 0), (height, height))
+
+
+def make_controller(clock):
+    return TrafficController({0: GreenTrafficLight(),
+                              1: Person(),
+                              2: RedTrafficLight(),
+                              3: SpeedLimit(25),
+                              4: SpeedLimit(40),
+                              5: StopSign(wait_time_in_sec=3, min_no_stop_sign=20)},
+                             speed_limit=40, clock=clock)
+
+
+def run_frames(controller, clock, frames, fps=20):
+    # frames: one list of label ids per frame, returns the speed of each frame
+    speeds = []
+    start = clock.now
+    for i, labels in enumerate(frames):
+        clock.now = start + float(i) / fps
+        speeds.append(controller.update([FakeObject(label_id) for label_id in labels], 480)['speed'])
+    clock.now = start + float(len(frames)) / fps
+    return speeds
+
+
+def test_stop_sign():
+    clock = FakeClock()
+    controller = make_controller(clock)
+    # stop sign in view for 6 s at 20 fps: wait 3 s (the last waiting frame is at 2.95 s)
+    # plus the 1 s full stop, then drive on past it
+    speeds = run_frames(controller, clock, [[5]] * 120)
+    assert speeds[:79] == [0] * 79, speeds[:79]
+    assert speeds[79:] == [40] * 41, speeds[79:]
+    # a frame that misses the stop sign during the wait does not end the wait
+    clock = FakeClock()
+    controller = make_controller(clock)
+    speeds = run_frames(controller, clock, [[5]] * 10 + [[]] + [[5]] * 89)
+    assert speeds[:79] == [0] * 79, speeds[:79]
+    assert speeds[79:] == [40] * 21, speeds[79:]
+    # the sign has to be out of view for 20 frames before it stops the car again
+    speeds = run_frames(controller, clock, [[]] * 19 + [[5]])
+    assert speeds[-1] == 40, speeds
+    speeds = run_frames(controller, clock, [[]] * 20 + [[5]])
+    assert speeds[-1] == 0, speeds
+
+
+def test_red_light():
+    clock = FakeClock()
+    controller = make_controller(clock)
+    # a red light stops the car for as long as it is seen, plus full_stop_time
+    speeds = run_frames(controller, clock, [[2]] * 5 + [[0]] * 30)
+    assert speeds[:24] == [0] * 24, speeds[:24]
+    assert speeds[24:] == [40] * 11, speeds[24:]
+    # far away (small) objects are ignored
+    speeds = [controller.update([FakeObject(2, height=10)], 480)['speed']]
+    assert speeds == [40], speeds
+
+
+def test_speed_limit():
+    clock = FakeClock()
+    controller = make_controller(clock)
+    speeds = run_frames(controller, clock, [[3]] * 3 + [[]] * 3 + [[4]] * 3)
+    assert speeds == [25] * 6 + [40] * 3, speeds
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_stop_sign()
+    test_red_light()
+    test_speed_limit()
+    logging.info('traffic object tests passed')
@@ -1,6 +1,5 @@
 import cv2
-from tflite_runtime.interpreter import Interpreter
-import numpy as np
+from tflite_utils import load_interpreter, timings_text, InputTensor, get_detection_outputs, postprocess_detections, draw_detections
 
 data_folder = "model_result/"
 
@@ -11,42 +10,19 @@ min_conf_threshold = 0.5
 with open(label_path, "r") as f:
     labels = [line.strip() for line in f.readlines()]
 
-interpreter = Interpreter(model_path=model_path)
-interpreter.allocate_tensors()
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
-_, height, width, _ = interpreter.get_input_details()[0]["shape"]
+interpreter, timings = load_interpreter(model_path)
+print("模型載入完成:", timings_text(timings))
+input_tensor = InputTensor(interpreter)
+output_details = input_tensor.output_details
 
 cap = cv2.VideoCapture(8)    # 樹莓派5同時連接Pi相機模組是8; 樹莓派4是1, 否則是0
-imWidth  = cap.get(cv2.CAP_PROP_FRAME_WIDTH) 
-imHeight = cap.get(cv2.CAP_PROP_FRAME_HEIGHT) 
 while cap.isOpened():
     success, frame = cap.read()
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    frame_resized = cv2.resize(frame_rgb, (width, height))
-    input_data = np.expand_dims(frame_resized, axis=0)
-    interpreter.set_tensor(input_details[0]["index"],input_data)
+    input_tensor.set_image(frame)
     interpreter.invoke()
-    boxes = interpreter.get_tensor(output_details[0]["index"])[0]
-    classes = interpreter.get_tensor(output_details[1]["index"])[0]
-    scores = interpreter.get_tensor(output_details[2]["index"])[0] 
-    for i in range(len(scores)):
-        if ((scores[i] > min_conf_threshold) and (scores[i] <= 1.0)):
-            min_y = int(max(1,(boxes[i][0] * imHeight)))
-            min_x = int(max(1,(boxes[i][1] * imWidth)))
-            max_y = int(min(imHeight,(boxes[i][2] * imHeight)))
-            max_x = int(min(imWidth,(boxes[i][3] * imWidth)))              
-            cv2.rectangle(frame, (min_x,min_y), (max_x,max_y), (10,255,0), 2)  
-            object_name = labels[int(classes[i])] 
-            label = "%s: %d%%" % (object_name, int(scores[i]*100))
-            labelSize, baseLine = cv2.getTextSize(label,
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-            label_min_y = max(min_x, labelSize[1] + 10)
-            cv2.rectangle(frame, (min_x, label_min_y-labelSize[1]-10),
-                                 (min_x+labelSize[0], label_min_y+baseLine-10), 
-                                 (255, 255, 255), cv2.FILLED) 
-            cv2.putText(frame, label, (min_x, label_min_y-7), 
-                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    boxes, classes, scores = get_detection_outputs(interpreter, output_details)
+    detections = postprocess_detections(boxes, classes, scores, frame.shape[0], frame.shape[1], min_conf_threshold)
+    draw_detections(frame, detections, labels)
     cv2.imshow("Object Detector", frame)
     if cv2.waitKey(1) == ord("q"):
         break
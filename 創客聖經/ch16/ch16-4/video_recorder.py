@@ -0,0 +1,140 @@
+import collections
+import logging
+import struct
+import cv2
+import numpy as np
+from frame_pipeline import FrameWriter
+
+_RAW_MAGIC = b'RAWF'
+_RAW_HEADER = struct.Struct('<4s3I')  # magic, height, width, channels
+
+
+class RawFrameWriter(object):
+    """
+    Appends uncompressed frames to a file, no encoding on the car. The file
+    is a small header followed by the frames back to back, so
+    open_raw_frames() can memory-map it as one (frames, height, width,
+    channels) array, and encode_raw_video() turns it into a video later
+    """
+
+    def __init__(self, path, size, channels=3):
+        # size: (width, height), like cv2.VideoWriter
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(_RAW_HEADER.pack(_RAW_MAGIC, size[1], size[0], channels))
+        self.frame_shape = (size[1], size[0], channels)
+
+    def write(self, frame):
+        if frame.shape != self.frame_shape:
+            logging.warning('%s: skipping a %s frame, expected %s' % (self.path, frame.shape, self.frame_shape))
+            return
+        self.file.write(memoryview(np.ascontiguousarray(frame, np.uint8)))
+
+    def release(self):
+        self.file.close()
+
+
+def open_raw_frames(path):
+    """ Memory-maps a RawFrameWriter file, returns a read-only uint8 array of all frames """
+    with open(path, 'rb') as f:
+        magic, height, width, channels = _RAW_HEADER.unpack(f.read(_RAW_HEADER.size))
+        if magic != _RAW_MAGIC:
+            raise ValueError('%s is not a raw frame file' % path)
+        f.seek(0, 2)
+        count = (f.tell() - _RAW_HEADER.size) // (height * width * channels)
+    if count == 0:
+        return np.empty((0, height, width, channels), np.uint8)
+    return np.memmap(path, np.uint8, 'r', _RAW_HEADER.size, (count, height, width, channels))
+
+
+def encode_raw_video(raw_path, video_path, fps=20.0, fourcc='XVID'):
+    # offline, e.g. on a PC after the drive: encode a raw frame file into a normal video
+    frames = open_raw_frames(raw_path)
+    _, height, width, _ = frames.shape
+    video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    for frame in frames:
+        video.write(np.asarray(frame))
+    video.release()
+    return len(frames)
+
+
+class VideoRecorder(object):
+    """
+    Records several video streams without slowing the control loop down:
+    write() only queues the frame, every stream has its own FrameWriter
+    thread and bounded queue. Per stream you choose:
+
+    block -- when the queue is full, wait (True) or drop the oldest frame (False)
+    every -- only record every Nth frame
+    raw   -- write uncompressed frames to a memory-mappable file instead of
+             encoding on the car, see encode_raw_video()
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency
+        self.streams = collections.OrderedDict()
+
+    def add_stream(self, name, path, size, fps=20.0, fourcc='XVID', maxsize=4, block=False, every=1, raw=False):
+        # size: (width, height)
+        if raw:
+            writer = RawFrameWriter(path, size)
+        else:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        self.streams[name] = FrameWriter(writer, name, maxsize, self.latency, block, every)
+
+    def write(self, name, frame):
+        # the frame is queued as is, pass a copy if the caller reuses the array
+        stream = self.streams.get(name)
+        if stream is not None:
+            stream.write(frame)
+
+    def stats(self):
+        return collections.OrderedDict((name, stream.stats()) for name, stream in self.streams.items())
+
+    def summary(self):
+        return 'recorder: ' + ', '.join('%s written %d, dropped %d, queued %d' % (
+            name, stats['written'], stats['dropped'], stats['depth']) for name, stats in self.stats().items())
+
+    def close(self):
+        # writes out what is still queued, then closes the files
+        for stream in self.streams.values():
+            stream.close()
+            stream.video_writer.release()
+        if self.streams:
+            logging.info(self.summary())
+        self.streams.clear()
+
+
+############################
+# Test Functions
+############################
+def test_video(video_file):
+    import time
+    cap = cv2.VideoCapture(video_file + '.avi')
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    recorder = VideoRecorder()
+    recorder.add_stream('video', '%s_recorded.avi' % video_file, size)
+    recorder.add_stream('half', '%s_recorded_half.avi' % video_file, size, fps=10.0, every=2)
+    recorder.add_stream('raw', '%s_recorded.raw' % video_file, size, raw=True, block=True)
+
+    start = time.monotonic()
+    frames = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        for name in ('video', 'half', 'raw'):
+            recorder.write(name, frame)
+        frames += 1
+    logging.info('queued %d frames in %.1f ms' % (frames, (time.monotonic() - start) * 1000))
+    recorder.close()
+
+    raw_frames = open_raw_frames('%s_recorded.raw' % video_file)
+    logging.info('raw file holds %d frames of %s' % (len(raw_frames), raw_frames.shape[1:]))
+    encode_raw_video('%s_recorded.raw' % video_file, '%s_recorded_raw.avi' % video_file)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_video("images/video01")